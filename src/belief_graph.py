@@ -1,7 +1,4 @@
-import os
-
 import networkx as nx
-from matplotlib import pyplot as plt
 
 class BeliefGraph:
     def __init__(self, game):
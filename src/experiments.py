@@ -0,0 +1,371 @@
+import argparse
+import csv
+import math
+import os
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from itertools import product
+from statistics import NormalDist
+
+import numpy as np
+
+from game_log import writeEvents
+from game_runner import GameRunner, gameRandom
+
+# The columns of mafia.csv, the settings of a game followed by its winners
+COLUMNS = ['Villagers', 'Mafia', 'Doctors', 'Informants', 'Mafia strategy', 'Informant strategy',
+           'Doctors strategy', 'Protected players before announcement', 'Informant_enabled', 'Winners']
+SETTINGS = ['villagers', 'mafiosi', 'doctors', 'informants', 'mafia_strategy', 'informant_strategy',
+            'doctors_strategy', 'num_protectedPlayers', 'informant_enabled']
+OUTCOMES = ('Villagers', 'Mafiosi', 'Tie')
+# The columns of the summary of an adaptive run, the settings of a cell followed by its
+# number of games and the count, ratio and confidence interval of every outcome
+SUMMARY_COLUMNS = COLUMNS[:-1] + ['Games'] + [f"{winners} {column}" for winners in OUTCOMES
+                                              for column in ('count', 'ratio', 'CI low', 'CI high')]
+
+
+def parameterGrid(villagers=(4,), mafiosi=(2,), doctors=(1,), informants=(1,),
+                  mafia_strategy=('enemy', 'allied', 'random'), informant_strategy=('deterministic', 'random'),
+                  doctors_strategy=('deterministic', 'random'), num_protectedPlayers=(1,),
+                  informant_enabled=(True, False)):
+    # The defaults are the cells of mafia.csv. The informant strategy does not matter
+    # when the informant is disabled, so such cells only use the first one.
+    cells = []
+    for values in product(villagers, mafiosi, doctors, informants, mafia_strategy, informant_strategy,
+                          doctors_strategy, num_protectedPlayers, informant_enabled):
+        settings = dict(zip(SETTINGS, values))
+        if not settings['informant_enabled'] and settings['informant_strategy'] != informant_strategy[0]:
+            continue
+        cells.append(settings)
+    return cells
+
+
+def cellKey(settings):
+    # The settings as they are written to the CSV file
+    return tuple(str(settings[name]) for name in SETTINGS)
+
+
+def countWins(path):
+    # The winners of the games in the CSV file, counted per cell
+    wins = {}
+    if not os.path.exists(path):
+        return wins
+    with open(path, newline='') as file:
+        for row in csv.reader(file):
+            if row and row != COLUMNS:
+                wins.setdefault(tuple(row[:-1]), Counter())[row[-1]] += 1
+    return wins
+
+
+def countFinishedGames(path):
+    return {key: sum(counts.values()) for key, counts in countWins(path).items()}
+
+
+def wilsonInterval(wins, games, confidence=0.95):
+    # The Wilson score interval of the ratio of wins
+    if games == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    ratio = wins / games
+    scale = 1 + z * z / games
+    centre = (ratio + z * z / (2 * games)) / scale
+    half = z * math.sqrt(ratio * (1 - ratio) / games + z * z / (4 * games * games)) / scale
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+def binomialCdf(wins, games, p):
+    # The probability of at most the given wins in the games, with p the chance of a win
+    if wins < 0:
+        return 0.0
+    if wins >= games or p <= 0:
+        return 1.0
+    if p >= 1:
+        return 0.0
+    k = np.arange(wins + 1)
+    coefficients = np.concatenate(([0.0], np.cumsum(np.log(games - k[1:] + 1) - np.log(k[1:]))))
+    terms = coefficients + k * math.log(p) + (games - k) * math.log1p(-p)
+    top = terms.max()
+    return min(1.0, float(np.exp(top) * np.exp(terms - top).sum()))
+
+
+def clopperPearsonInterval(wins, games, confidence=0.95):
+    # The exact binomial interval of the ratio of wins, with its bounds found by bisection
+    if games == 0:
+        return 0.0, 1.0
+    alpha = (1 - confidence) / 2
+
+    def bisect(belowBound):
+        low, high = 0.0, 1.0
+        for _ in range(50):
+            middle = (low + high) / 2
+            if belowBound(middle):
+                low = middle
+            else:
+                high = middle
+        return (low + high) / 2
+
+    lower = 0.0 if wins == 0 else bisect(lambda p: 1 - binomialCdf(wins - 1, games, p) < alpha)
+    upper = 1.0 if wins == games else bisect(lambda p: binomialCdf(wins, games, p) > alpha)
+    return lower, upper
+
+
+INTERVALS = {'wilson': wilsonInterval, 'clopper-pearson': clopperPearsonInterval}
+
+
+class CellStatistics:
+    """ The outcomes of the games of one cell so far, with confidence intervals of the
+        ratio of each outcome. """
+
+    def __init__(self, settings, wins=None, confidence=0.95, method='wilson'):
+        self.settings = settings
+        self.wins = Counter(wins or {})
+        self.games = sum(self.wins.values())
+        self.confidence = confidence
+        self.interval = INTERVALS[method]
+        self.cached = None  # The intervals, until the next game is added
+
+    def add(self, winners):
+        self.wins[winners] += 1
+        self.games += 1
+        self.cached = None
+
+    def intervals(self):
+        if self.cached is None:
+            self.cached = {winners: self.interval(self.wins[winners], self.games, self.confidence)
+                           for winners in OUTCOMES}
+        return self.cached
+
+    def width(self):
+        # The width of the widest interval of the outcomes
+        return max(high - low for low, high in self.intervals().values())
+
+    def row(self):
+        row = list(cellKey(self.settings)) + [self.games]
+        for winners, (low, high) in self.intervals().items():
+            ratio = self.wins[winners] / self.games if self.games else 0.0
+            row += [self.wins[winners], f"{ratio:.4f}", f"{low:.4f}", f"{high:.4f}"]
+        return row
+
+
+def playGames(settings, start, count, seed=None, events=False):
+    # With a seed, game number index of every cell uses gameRandom(seed, index), so the
+    # cells of a grid are compared on the same random numbers. Returns the winners and,
+    # if asked for, the event log of each game.
+    results = []
+    for index in range(start, start + count):
+        log = [] if events else None
+        winners = GameRunner(**settings, rng=None if seed is None else gameRandom(seed, index),
+                             eventLog=log).run().winners
+        if events:
+            # Mark the game in its setup event, to find it in the log of a whole run
+            log[0]['game'] = dict(settings, seed=seed, index=index)
+        results.append((winners, log))
+    return results
+
+
+def runExperiments(cells, games, path='mafia.csv', processes=None, chunksize=10, seed=None, events=None):
+    # Play games until every cell has the given number of games in the CSV file. Games
+    # are played in chunks of one cell and finished chunks are appended right away, so
+    # an interrupted run continues where it stopped. The rows of a cell are written in
+    # the order of the games, the n-th row of a cell is game number n. If events is a
+    # path, the event logs of the games are appended to it, see game_log.
+    finished = countFinishedGames(path)
+    tasks = []
+    for settings in cells:
+        done = finished.get(cellKey(settings), 0)
+        for start in range(done, games, chunksize):
+            tasks.append((settings, start, min(chunksize, games - start)))
+    print(f"Playing {sum(count for _, _, count in tasks)} games in {len(tasks)} chunks.")
+
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a', newline='') as file, \
+            (open(events, 'a') if events else nullcontext()) as event_file:
+        writer = csv.writer(file)
+        if new_file:
+            writer.writerow(COLUMNS)
+
+        # Chunks that finished before an earlier chunk of their cell wait here
+        results = {}
+        next_game = {cellKey(settings): finished.get(cellKey(settings), 0) for settings in cells}
+
+        def write(settings, start, winners):
+            key = cellKey(settings)
+            results[key, start] = winners
+            while (key, next_game[key]) in results:
+                chunk = results.pop((key, next_game[key]))
+                for winners, log in chunk:
+                    writer.writerow(list(key) + [winners])
+                    if event_file is not None:
+                        writeEvents(event_file, log)
+                next_game[key] += len(chunk)
+            file.flush()
+            if event_file is not None:
+                event_file.flush()
+
+        if processes == 1:
+            for settings, start, count in tasks:
+                write(settings, start, playGames(settings, start, count, seed, events is not None))
+            return
+
+        processes = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(processes) as executor:
+            # Keep a few chunks per process queued instead of submitting all of them
+            pending = {}
+            tasks = iter(tasks)
+            while True:
+                for settings, start, count in tasks:
+                    future = executor.submit(playGames, settings, start, count, seed, events is not None)
+                    pending[future] = (settings, start)
+                    if len(pending) >= 4 * processes:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(*pending.pop(future), future.result())
+
+
+def runAdaptive(cells, width=0.1, path='mafia.csv', summary='mafia_summary.csv', confidence=0.95,
+                method='wilson', min_games=50, max_games=5000, processes=None, chunksize=10, seed=None,
+                events=None):
+    # Play games until the confidence interval of the ratio of every outcome of a cell is
+    # narrower than width, or the cell has max_games games. Each new chunk goes to the cell
+    # with the widest intervals, counting the games still being played, so the games go to
+    # the cells that are the most uncertain. A cell only stops at the end of a chunk, taken
+    # in the order of the games, and chunks that finish later are dropped, so with a seed
+    # the games of a run do not depend on the number of processes. The games are appended
+    # to path as by runExperiments, and a run continues from the games that are there.
+    # The statistics of every cell are written to summary at the end.
+    wins = countWins(path)
+    stats = {cellKey(settings): CellStatistics(settings, wins.get(cellKey(settings)), confidence, method)
+             for settings in cells}
+
+    def finished(cell):
+        return cell.games >= max_games or cell.games >= min_games and cell.width() < width
+
+    stopped = {key for key, cell in stats.items() if finished(cell)}
+    scheduled = {key: cell.games for key, cell in stats.items()}
+    print(f"Sampling {len(stats) - len(stopped)} of {len(stats)} cells up to an interval width of {width}.")
+
+    def nextTask():
+        # The next chunk of the cell with the widest expected intervals once its games in
+        # play are done, or None if every cell is done or only waits for those games
+        best, bestWidth = None, None
+        for key, cell in stats.items():
+            if key in stopped or scheduled[key] >= max_games:
+                continue
+            playing = scheduled[key] - cell.games
+            expected = cell.width() * math.sqrt((cell.games + 1) / (cell.games + playing + 1))
+            if playing and expected < width:
+                continue
+            if best is None or expected > bestWidth:
+                best, bestWidth = key, expected
+        if best is None:
+            return None
+        start = scheduled[best]
+        count = min(chunksize, max_games - start)
+        scheduled[best] += count
+        return stats[best].settings, start, count
+
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a', newline='') as file, \
+            (open(events, 'a') if events else nullcontext()) as event_file:
+        writer = csv.writer(file)
+        if new_file:
+            writer.writerow(COLUMNS)
+
+        # Chunks that finished before an earlier chunk of their cell wait here
+        results = {}
+        next_game = {key: cell.games for key, cell in stats.items()}
+
+        def write(settings, start, chunk):
+            key = cellKey(settings)
+            cell = stats[key]
+            results[key, start] = chunk
+            while (key, next_game[key]) in results:
+                chunk = results.pop((key, next_game[key]))
+                next_game[key] += len(chunk)
+                if key in stopped:
+                    continue
+                for winners, log in chunk:
+                    writer.writerow(list(key) + [winners])
+                    cell.add(winners)
+                    if event_file is not None:
+                        writeEvents(event_file, log)
+                if finished(cell):
+                    stopped.add(key)
+                    print(f"{', '.join(key)}: stopped after {cell.games} games, interval width {cell.width():.4f}")
+            file.flush()
+            if event_file is not None:
+                event_file.flush()
+
+        if processes == 1:
+            task = nextTask()
+            while task is not None:
+                write(*task[:2], playGames(*task, seed, events is not None))
+                task = nextTask()
+        else:
+            processes = processes or os.cpu_count() or 1
+            with ProcessPoolExecutor(processes) as executor:
+                pending = {}
+                while True:
+                    while len(pending) < 4 * processes:
+                        task = nextTask()
+                        if task is None:
+                            break
+                        pending[executor.submit(playGames, *task, seed, events is not None)] = task[:2]
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(*pending.pop(future), future.result())
+
+    with open(summary, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(SUMMARY_COLUMNS)
+        for cell in stats.values():
+            writer.writerow(cell.row())
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play games of Mafia for every cell of a parameter grid "
+                                                 "and append the winners to a CSV file.")
+    parser.add_argument('--villagers', type=int, nargs='+', default=[4])
+    parser.add_argument('--mafiosi', type=int, nargs='+', default=[2])
+    parser.add_argument('--doctors', type=int, nargs='+', default=[1])
+    parser.add_argument('--informants', type=int, nargs='+', default=[1])
+    parser.add_argument('--mafia-strategy', nargs='+', default=['enemy', 'allied', 'random'])
+    parser.add_argument('--informant-strategy', nargs='+', default=['deterministic', 'random'])
+    parser.add_argument('--doctors-strategy', nargs='+', default=['deterministic', 'random'])
+    parser.add_argument('--protected-players', type=int, nargs='+', default=[1])
+    parser.add_argument('--informant-enabled', nargs='+', default=['True', 'False'], choices=['True', 'False'])
+    parser.add_argument('--games', type=int, default=50, help="games per cell, or the least games per cell with --width")
+    parser.add_argument('--output', default='mafia.csv')
+    parser.add_argument('--processes', type=int, default=None, help="default: number of CPUs")
+    parser.add_argument('--chunksize', type=int, default=10, help="games per task")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="master seed, game n of a cell uses the stream of (seed, n)")
+    parser.add_argument('--events', default=None, help="JSONL file to append the event logs of the games to")
+    parser.add_argument('--width', type=float, default=None,
+                        help="sample adaptively, until the confidence intervals of a cell are narrower than this")
+    parser.add_argument('--confidence', type=float, default=0.95, help="confidence level of the intervals")
+    parser.add_argument('--interval', default='wilson', choices=list(INTERVALS))
+    parser.add_argument('--max-games', type=int, default=5000, help="most games per cell with --width")
+    parser.add_argument('--summary', default='mafia_summary.csv',
+                        help="CSV file for the games and confidence intervals of every cell with --width")
+    args = parser.parse_args()
+
+    cells = parameterGrid(args.villagers, args.mafiosi, args.doctors, args.informants, args.mafia_strategy,
+                          args.informant_strategy, args.doctors_strategy, args.protected_players,
+                          [enabled == 'True' for enabled in args.informant_enabled])
+    if args.width is None:
+        runExperiments(cells, args.games, args.output, args.processes, args.chunksize, args.seed, args.events)
+    else:
+        runAdaptive(cells, args.width, args.output, args.summary, args.confidence, args.interval, args.games,
+                    args.max_games, args.processes, args.chunksize, args.seed, args.events)
+
+
+if __name__ == '__main__':
+    main()
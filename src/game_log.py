@@ -0,0 +1,116 @@
+import io
+import json
+from contextlib import redirect_stdout
+
+from mafia_model import MafiaGame
+from mafia_players import Mafioso
+
+# A game log holds one JSON object per line and event, with the event in 'type'. Players
+# are given by player_id. The events and their fields are
+#   setup                   villagers, mafiosi, doctors, informants, world, pointed, counting and
+#                           targets, the [informant, mafioso] pairs; every game starts with it
+#   round                   round, the start of a round
+#   night_target            player, the villager chosen by the mafiosi
+#   protect                 player, the player chosen by the doctors
+#   save                    player, saved by the doctors from the night phase
+#   kill                    player, killed at night or eliminated by the vote
+#   doctor_announcement     doctor, who reveals the saved players and their own identity
+#   informant_announcement  mafioso, informant
+#   vote                    voter, target
+#   knowledge_update        player, who correctly suspected an eliminated mafioso
+#   end                     winners
+
+
+def writeEvents(file, events):
+    for event in events:
+        file.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+
+def readGames(path):
+    # Yields the list of events of each game in the log
+    events = []
+    with open(path) as file:
+        for line in file:
+            event = json.loads(line)
+            if event['type'] == 'setup' and events:
+                yield events
+                events = []
+            events.append(event)
+    if events:
+        yield events
+
+
+class GameReplay:
+    """ Rebuilds the state of a logged game by applying its events to a new MafiaGame.
+        The choices of the players are taken from the log, so no strategy is run and no
+        random numbers are drawn. """
+
+    def __init__(self, events, **model_options):
+        self.events = events
+        self.model_options = model_options
+        self.reset()
+
+    def reset(self):
+        setup = self.events[0]
+        options = {'pointed': setup['pointed'], 'counting': setup['counting'], **self.model_options}
+        with redirect_stdout(io.StringIO()):
+            self.game = MafiaGame(villagers=setup['villagers'], mafiosi=setup['mafiosi'],
+                                  doctors=setup['doctors'], informants=setup['informants'],
+                                  informantTargets=dict(setup['targets']), **options)
+        if self.game.currentWorld != setup['world']:
+            raise ValueError(f"The log is of world {setup['world']}, not {self.game.currentWorld}")
+        self.position = 1
+        self.round = 0
+        self.winners = None
+
+    def player(self, player_id):
+        return self.game.allPlayers[player_id]
+
+    def step(self):
+        # Applies the next event and returns it, or None at the end of the log
+        if self.position >= len(self.events):
+            return None
+        event = self.events[self.position]
+        self.position += 1
+        with redirect_stdout(io.StringIO()):
+            self.apply(event)
+        return event
+
+    def apply(self, event):
+        if event['type'] == 'round':
+            self.round = event['round']
+        elif event['type'] == 'save':
+            self.game.savePlayer(self.player(event['player']))
+        elif event['type'] == 'kill':
+            self.game.kill(self.player(event['player']))
+        elif event['type'] == 'doctor_announcement':
+            self.game.announceSavedPlayers(self.player(event['doctor']))
+        elif event['type'] == 'informant_announcement':
+            self.game.revealMafioso(self.player(event['mafioso']), self.player(event['informant']))
+        elif event['type'] == 'vote':
+            target = self.player(event['target'])
+            if isinstance(target, Mafioso):
+                self.player(event['voter']).suspectMafioso(target)
+        elif event['type'] == 'knowledge_update':
+            self.player(event['player']).updateKnowledge()
+        elif event['type'] == 'end':
+            self.winners = event['winners']
+        # night_target and protect are choices, that only take effect by later events
+
+    def seekRound(self, round):
+        # Returns the game as it was at the start of the given round, round 1 being the
+        # state right after the setup. Seeking back replays the log from the start.
+        if round <= self.round:
+            self.reset()
+        while self.position < len(self.events):
+            event = self.events[self.position]
+            if event['type'] == 'round' and event['round'] >= round:
+                break
+            self.step()
+        return self.game
+
+    def run(self):
+        # Applies all remaining events and returns the winners
+        while self.step() is not None:
+            pass
+        return self.winners
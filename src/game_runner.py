@@ -0,0 +1,214 @@
+import copy
+import io
+import random
+from collections import namedtuple
+from contextlib import nullcontext, redirect_stdout
+
+import numpy as np
+
+from mafia_model import MafiaGame
+
+# Outcome of one game: winners is "Mafiosi", "Villagers" or "Tie", survivors and
+# eliminated hold player names, the latter in the order the players died
+GameResult = namedtuple('GameResult', ['winners', 'rounds', 'survivors', 'eliminated'])
+
+
+def gameRandom(seed, index):
+    # The generator of game number index of a run with the given master seed. Games with
+    # the same seed and index draw the same random numbers, whatever process plays them.
+    state = np.random.SeedSequence([seed, index]).generate_state(4)
+    return random.Random(int.from_bytes(state.tobytes(), 'little'))
+
+
+class GameRunner:
+    """ Plays a game of Mafia without any user interface. An observer, if given, is called
+        as observer(event, text) with the events
+            'log'      a line of the game log,
+            'snapshot' a moment to draw the beliefs of the players,
+            'end'      the end of the game, text is the winners.
+        Other keyword arguments, such as rng=gameRandom(seed, index) or eventLog=[], go to
+        MafiaGame. """
+
+    def __init__(self, villagers=10, mafiosi=2, doctors=1, informants=1,
+                 mafia_strategy='enemy', informant_strategy='random',
+                 doctors_strategy='deterministic', num_protectedPlayers=1, informant_enabled=True,
+                 observer=None, verbose=False, **model_options):
+        self.mafia_strategy = mafia_strategy
+        self.informant_strategy = informant_strategy
+        self.doctors_strategy = doctors_strategy
+        self.num_protectedPlayers = num_protectedPlayers
+        self.informant_enabled = informant_enabled
+        self.observer = observer
+        self.verbose = verbose
+        self.votes = None
+        self.round = 0
+        self.winners = None
+        with self.output():
+            self.game = MafiaGame(villagers=villagers, mafiosi=mafiosi, doctors=doctors,
+                                  informants=informants, **model_options)
+        self.totalPlayers = len(self.game.players)
+        self.eliminated = []
+
+    def fork(self, rng=None):
+        # Returns a copy of the runner that continues the game from its current state
+        # on a fork of the game, see MafiaGame.fork
+        forked = copy.copy(self)
+        forked.game = self.game.fork(rng)
+        if self.votes is not None:
+            forked.votes = {forked.game.allPlayers[player.player_id]: vote for player, vote in self.votes.items()}
+        forked.eliminated = list(self.eliminated)
+        return forked
+
+    def output(self):
+        # The game prints what happens, which is only wanted in verbose mode
+        return nullcontext() if self.verbose else redirect_stdout(io.StringIO())
+
+    def notify(self, event, text=None):
+        if self.observer is not None:
+            self.observer(event, text)
+
+    def run(self):
+        # Play rounds until the game is over
+        while self.winners is None:
+            self.playRound()
+        return self.result()
+
+    def result(self):
+        return GameResult(self.winners, self.round, [player.name for player in self.game.alivePlayers],
+                          list(self.eliminated))
+
+    def finish(self, winners):
+        self.winners = winners
+        self.game.logEvent('end', winners=winners)
+        self.notify('end', winners)
+        self.notify('snapshot')
+        if winners == 'Tie':
+            self.notify('log', "Game Over, Tie!")
+        else:
+            self.notify('log', f"Game Over, {winners} win!")
+
+    def kill(self, player):
+        self.game.kill(player)
+        self.eliminated.append(player.name)
+
+    def playRound(self):
+        with self.output():
+            self.playPhases()
+        return self.winners
+
+    def playPhases(self):
+        self.round += 1
+        self.game.logEvent('round', round=self.round)
+        self.notify('log', f"\n\n=== Round {self.round} ===\n\n")
+
+        for player in self.game.alivePlayers:
+            if self.verbose:
+                player.print_state()
+            self.notify('log', f"{player.name} (Role: {player.role.name})\n")
+
+        win = self.game.checkWin()
+        if win:
+            self.finish(win)
+            return
+
+        if self.round > 1:
+            self.notify('snapshot')
+
+        # The events of the night phase are applied to the model together
+        with self.game.batchEvents():
+            # Perform a round of night phase
+            if len(self.game.alivePlayers) == self.totalPlayers:
+                # In the first round, always kill randomly a villager during the night phase
+                villager = self.game.voteVillager(mafia_strategy='random')
+            else:
+                # In the rest of the rounds, follow a certain strategy to kill
+                villager = self.game.voteVillager(mafia_strategy=self.mafia_strategy, votes=self.votes)
+
+            # Choose a player to protect after the night phase
+            protected = self.game.choose_protected_player()
+            print(f"The doctors, if present, choose to protect {protected.name}.")
+            # Check whether the player that was killed will be indeed saved
+            if 'DOCTOR' in [player.role.name for player in self.game.alivePlayers] and villager == protected:
+                if self.game.protectedID_is_known(protected):
+                    print(f"{villager.name} was saved by the Doctor(s) after the night phase, but it is already common "
+                          f"knowledge that he is innocent!\n")
+                else:
+                    self.game.savePlayer(protected)
+                    print(f"{villager.name} was saved by the Doctor(s) after the night phase!\n")
+            else:
+                # Either the Doctor is not active, or the protected player is not the one that was killed
+                # Kill the innocent player and update the model
+                self.kill(villager)
+            self.notify('log', f"{villager.name} was killed during the night phase!\n")
+
+            if 'DOCTOR' in [player.role.name for player in self.game.alivePlayers]:
+                # For this round, decide whether Doctor(s) will let the rest players know about their identity and knowledge
+                self.game.apply_doctors_strategy(doctors_strategy=self.doctors_strategy,
+                                                 num_protectedPLayers=self.num_protectedPlayers)
+
+        # The mafiosi might win the game by killing a villager at night
+        win = self.game.checkWin()
+        if win:
+            self.finish(win)
+            return
+
+        elif len(self.game.alivePlayers) <= 2:
+            self.finish('Tie')
+            return
+
+        # Check whether the Informant will reveal the identity of the one known mafia member
+        if self.informant_enabled and not self.game.revealedMafioso:
+            self.game.apply_informant_strategy(informant_strategy=self.informant_strategy)
+
+        # Perform a round of day phase
+        voteCount = {}
+        self.votes = {}
+        for player in self.game.alivePlayers:
+            # Open vote for the player to be eliminated
+            vote = player.vote()
+            self.game.logEvent('vote', voter=player.player_id, target=vote.player_id)
+            self.notify('log', f"{player.name} votes to eliminate {vote.name}")
+            if vote in voteCount:
+                voteCount[vote] += 1
+            else:
+                voteCount[vote] = 1
+
+            if vote.role.name == 'MAFIOSO':
+                # Keep track of the votes against true Mafia members
+                player.suspectMafioso(vote)
+                self.votes[player] = 1
+            else:
+                self.votes[player] = 0
+
+        # Find the player with the majority of votes to be eliminated during the day phase
+        maxVote = 0
+        maxPlayer = None
+        for player in voteCount:
+            if voteCount[player] > maxVote:
+                maxVote = voteCount[player]
+                maxPlayer = player
+        self.notify('log', f"{maxPlayer.name} is eliminated!\n")
+        with self.game.batchEvents():
+            # Kill the player and update the model
+            self.kill(maxPlayer)
+
+            for player in self.game.players:
+                self.notify('log', f"{player.name} correctly suspects {player.accusations}")
+
+            if maxPlayer.role.name == 'MAFIOSO':
+                # Update players' beliefs if a Mafia member is eliminated
+                for player in self.game.players:
+                    if player.accusations[maxPlayer.name] >= 1:
+                        self.notify('log', f"{player.name} correctly suspected {maxPlayer.name}!")
+                        self.game.logEvent('knowledge_update', player=player.player_id)
+                        player.updateKnowledge()
+
+        self.notify('log', "---------------------------------------------------------------------------------------------------\n")
+
+        win = self.game.checkWin()
+        if win:
+            self.finish(win)
+            return
+
+        if self.round == 1:
+            self.notify('snapshot')
@@ -1,13 +1,24 @@
+import copy
 import random
+from contextlib import contextmanager
 from belief_graph import BeliefGraph
 from mafia_players import Mafioso, Roles, Villager, Doctor, Informant
-from mlsolver.model import Mafia
+from mlsolver.model import Conjunction, CountingMafia, Mafia, PointedMafia
 import numpy as np
 
 class MafiaGame:
-    def __init__(self, villagers=1, mafiosi=1, doctors=0, informants=0):
+    def __init__(self, villagers=1, mafiosi=1, doctors=0, informants=0, pointed=False, counting=False, rng=None,
+                 eventLog=None, informantTargets=None):
+        # All random choices of the game and its players are drawn from this generator,
+        # so a game is reproduced by passing a random.Random with the same seed
+        self.rng = rng if rng is not None else random.Random()
+        # If a list is given, the events of the game are appended to it as dicts, see game_log
+        self.eventLog = eventLog
         self.belief_graph = BeliefGraph(self)
-        self.model = Mafia({"mafiosi": mafiosi, "villagers": villagers, "informants": informants, "doctors": doctors})
+        roles = {"mafiosi": mafiosi, "villagers": villagers, "informants": informants, "doctors": doctors}
+        # A pointed model only keeps what the agents consider possible in the actual world,
+        # so it is built once the actual world is known, as is the counting abstraction
+        self.model = None if pointed or counting else Mafia(roles)
         self.players = []
         
         self.addPlayers(mafiosi, Mafioso)
@@ -16,23 +27,40 @@ class MafiaGame:
         self.addPlayers(informants, Informant)
         
         self.alivePlayers = self.players
+        self.allPlayers = list(self.players)  # Indexed by player_id, also after players die
         self.deadPlayers = []
         self.protectedPLayers = []
         self.revealedMafioso = False
+        self.eventQueue = None  # List of (predicate, recipients) while events are batched
         self.currentWorld = ""
         for player in self.players:
             self.currentWorld += player.role.name[0]
         self.currentWorld = self.currentWorld.upper()
         print("Actual world: " + self.currentWorld)
+        if pointed:
+            self.model = PointedMafia(roles, self.currentWorld)
+        elif counting:
+            self.model = CountingMafia(roles, self.currentWorld)
         
         for num, player in enumerate(self.players):
             player.player_id = num
             player.model = self.model
+            player.game = self
+            player.rng = self.rng
             player.currentWorld = self.currentWorld
+        # The mafioso known to each informant, by player_id, is drawn at random unless given
+        informantTargets = informantTargets or {}
         for player in self.players:
             player.alivePlayers = self.alivePlayers
-            player.initializeBeliefs()
+            if player.player_id in informantTargets:
+                player.initializeBeliefs(target=self.allPlayers[informantTargets[player.player_id]])
+            else:
+                player.initializeBeliefs()
             player.accusations = {player.name: 0 for player in self.players if player.role.name == 'MAFIOSO'}
+        self.logEvent('setup', villagers=villagers, mafiosi=mafiosi, doctors=doctors, informants=informants,
+                      world=self.currentWorld, pointed=pointed, counting=counting,
+                      targets=[[player.player_id, player.target.player_id] for player in self.players
+                               if isinstance(player, Informant) and player.target is not None])
 
     def addPlayers(self, count, Role):
         for itr in range(count):
@@ -41,6 +69,85 @@ class MafiaGame:
             player.belief_graph = self.belief_graph
             self.players.append(player)
 
+    def fork(self, rng=None):
+        # Returns a copy of the game in its current state, that plays on independently.
+        # The Kripke structure and the beliefs of the players are shared until either
+        # game changes them. Unless another rng is given, the fork continues with the
+        # same random numbers as this game.
+        self.applyEvents()
+        forked = copy.copy(self)
+        if rng is None:
+            rng = random.Random()
+            rng.setstate(self.rng.getstate())
+        forked.rng = rng
+        forked.model = copy.copy(self.model)
+        forked.model.ks = self.model.ks.fork()
+        forked.belief_graph = BeliefGraph(forked)
+        forked.eventQueue = None
+        forked.eventLog = None if self.eventLog is None else list(self.eventLog)
+
+        players = {player: player.fork() for player in self.allPlayers}
+        forked.allPlayers = [players[player] for player in self.allPlayers]
+        forked.players = forked.alivePlayers = [players[player] for player in self.alivePlayers]
+        forked.deadPlayers = [players[player] for player in self.deadPlayers]
+        forked.protectedPLayers = [players[player] for player in self.protectedPLayers]
+        for player in forked.allPlayers:
+            player.game = forked
+            player.model = forked.model
+            player.rng = forked.rng
+            player.belief_graph = forked.belief_graph
+            player.alivePlayers = forked.alivePlayers
+            player.players = [players[other] for other in player.players]
+            if isinstance(player, Informant) and player.target is not None:
+                player.target = players[player.target]
+        return forked
+
+    def logEvent(self, event, **data):
+        if self.eventLog is not None:
+            self.eventLog.append({'type': event, **data})
+
+    @contextmanager
+    def batchEvents(self):
+        # Queue the events of a phase and apply them together when the phase ends.
+        # Reading beliefs applies the queued events first, so the outcome is the same
+        # as applying each event right away.
+        if self.eventQueue is not None:
+            yield
+            return
+        self.eventQueue = []
+        try:
+            yield
+        finally:
+            self.applyEvents()
+            self.eventQueue = None
+
+    def announce(self, predicate, recipients):
+        # The recipients only keep the relations to worlds that satisfy the predicate
+        if self.eventQueue is None:
+            for player in recipients:
+                player.restrictRelations(predicate)
+        else:
+            self.eventQueue.append((predicate, list(recipients)))
+
+    def applyEvents(self):
+        if not self.eventQueue:
+            return
+        events = self.eventQueue
+        self.eventQueue = []
+        predicates = {}
+        for predicate, recipients in events:
+            for player in recipients:
+                predicates.setdefault(player, []).append(predicate)
+        # Restrictions commute, so every player needs only one restriction by all its
+        # events. Players with the same events share the evaluation per world.
+        groups = {}
+        for player, player_predicates in predicates.items():
+            groups.setdefault(tuple(player_predicates), []).append(player)
+        for group_predicates, players in groups.items():
+            predicate = Conjunction(group_predicates)
+            for player in players:
+                player.restrictRelations(predicate)
+
     def voteVillager(self,  mafia_strategy='random', votes=None):
         # Night phase strategies
         candidates = self.get_voting_priority(['DOCTOR'])
@@ -49,20 +156,26 @@ class MafiaGame:
         if not candidates:
             candidates = self.apply_mafia_strategy(mafia_strategy, votes)
 
-        villager = random.choice(candidates)
+        villager = self.rng.choice(candidates)
+        self.logEvent('night_target', player=villager.player_id)
 
         return villager
 
     def get_voting_priority(self, role):
-        priority_players = []
-        for player in self.alivePlayers:
-            if player.role.name == 'VILLAGER':
-                # Revealed special roles have a higher priority to be killed
-                for belief in player.playerBeliefs:
-                    if belief[0] in self.alivePlayers and belief[1] == role:
-                        priority_players.append(belief[0])
+        villagers = [player for player in self.alivePlayers if player.role.name == 'VILLAGER']
+        if not villagers:
+            return []
+        # Revealed special roles have a higher priority to be killed, i.e. the alive
+        # players that some villager believes to have exactly the given roles
+        roles = np.array([r.name in role for r in Roles])
+        beliefs = np.stack([player.beliefMatrix for player in villagers])
+        matches = (beliefs == roles).all(axis=2) & self.aliveMask()
+        return [self.allPlayers[num] for num in np.nonzero(matches)[1]]
 
-        return priority_players
+    def aliveMask(self):
+        alive = np.zeros(len(self.allPlayers), dtype=bool)
+        alive[[player.player_id for player in self.alivePlayers]] = True
+        return alive
 
     def apply_mafia_strategy(self, mafia_strategy, votes):
         candidates = None
@@ -84,21 +197,18 @@ class MafiaGame:
     def choose_protected_player(self):
         # Choose one player to protect during the night phase
         candidates = [player for player in self.alivePlayers]
-        protected = random.choice(candidates)
+        protected = self.rng.choice(candidates)
+        self.logEvent('protect', player=protected.player_id)
         return protected
     
     def protectedID_is_known(self, protected):
         """ This function is called only if at least one Doctor is alive. """
         for player in self.alivePlayers:
             if player.role.name == 'VILLAGER' and player != protected:
-                for belief in player.playerBeliefs:
-                    if belief[0] == protected:
-                        if 'MAFIOSO' not in belief[1]:
-                            return True
-                        else:
-                            return False
+                return not player.beliefMatrix[protected.player_id, Roles.MAFIOSO.value]
     def savePlayer(self, protected):
         """ This function is called only if at least one Doctor is alive. """
+        self.logEvent('save', player=protected.player_id)
         if protected not in self.protectedPLayers:
             self.protectedPLayers.append(protected)
         # Update the knowledge of Doctors about this player
@@ -113,15 +223,11 @@ class MafiaGame:
             self.make_public_announcement()
         elif doctors_strategy == 'random' and len(self.protectedPLayers) > 0:
             # Reveal the Doctor(s) knowledge with a certain probability
-            if np.random.rand() > 0.5:
+            if self.rng.random() > 0.5:
                 # Make a public announcement
                 self.make_public_announcement()
 
     def make_public_announcement(self):
-        print("A Doctor will make a public announcement about the saved players!\n")
-        for player in self.protectedPLayers:
-            print(f"Public Announcement of Doctor(s): {player.name} is an innocent saved by the Doctor(s)!\n")
-            player.updateKnowledge()
         # Reveal the identity of one alive Doctor
         candidate_doctors = [cand for cand in self.alivePlayers if isinstance(cand, Doctor)]
         protected_doctors = [doctor for doctor in candidate_doctors if doctor in self.protectedPLayers]
@@ -129,15 +235,25 @@ class MafiaGame:
             if len(protected_doctors) == 1:
                 doctor = protected_doctors[0]
             elif len(protected_doctors) > 1:
-                doctor = random.choice(protected_doctors)
+                doctor = self.rng.choice(protected_doctors)
         else:
-            doctor = random.choice(candidate_doctors)
+            doctor = self.rng.choice(candidate_doctors)
+        self.announceSavedPlayers(doctor)
+
+    def announceSavedPlayers(self, doctor):
+        self.logEvent('doctor_announcement', doctor=doctor.player_id,
+                      saved=[player.player_id for player in self.protectedPLayers])
+        print("A Doctor will make a public announcement about the saved players!\n")
+        for player in self.protectedPLayers:
+            print(f"Public Announcement of Doctor(s): {player.name} is an innocent saved by the Doctor(s)!\n")
+            player.updateKnowledge()
         doctor.revealPlayerID()
         print(f"The identity of {doctor.name} is now revealed!\n")
         # Empty the protected players list
         self.protectedPLayers = []
 
     def kill(self, player):
+        self.logEvent('kill', player=player.player_id)
         self.alivePlayers.remove(player)
         self.deadPlayers.append(player)
         self.protectedPLayers.remove(player) if player in self.protectedPLayers else None
@@ -148,24 +264,27 @@ class MafiaGame:
         alive_mafiosi = [cand for cand in self.alivePlayers if isinstance(cand, Mafioso)]
         if known_mafioso in alive_mafiosi:
             if len(alive_mafiosi) == 1 or informant_strategy == 'deterministic':
-                print(f"Public announcement of Informant: The player {known_mafioso.name} is a Mafioso!\n")
-                known_mafioso.revealPlayerID()
-                informant.revealPlayerID()
-                self.revealedMafioso = True
+                self.revealMafioso(known_mafioso, informant)
             elif informant_strategy == 'random':
                 # Reveal the identity of one mafia member with a certain probability
-                if np.random.rand() > 0.5:
-                    print(f"Public announcement of Informant: The player {known_mafioso.name} is a Mafioso!\n")
-                    known_mafioso.revealPlayerID()
-                    informant.revealPlayerID()
-                    self.revealedMafioso = True
+                if self.rng.random() > 0.5:
+                    self.revealMafioso(known_mafioso, informant)
+
+    def revealMafioso(self, mafioso, informant):
+        self.logEvent('informant_announcement', mafioso=mafioso.player_id, informant=informant.player_id)
+        print(f"Public announcement of Informant: The player {mafioso.name} is a Mafioso!\n")
+        mafioso.revealPlayerID()
+        informant.revealPlayerID()
+        self.revealedMafioso = True
 
     def find_mafioso(self):
+        mafiosi = np.array([isinstance(player, Mafioso) for player in self.allPlayers])
+        onlyMafioso = np.arange(len(Roles)) == Roles.MAFIOSO.value
         for player in self.alivePlayers:
             if isinstance(player, Informant):
-                for belief in player.playerBeliefs:
-                    if isinstance(belief[0], Mafioso) and belief[1] == ['MAFIOSO']:
-                        return belief[0], player
+                known = np.flatnonzero(mafiosi & (player.beliefMatrix == onlyMafioso).all(axis=1))
+                if known.size:
+                    return self.allPlayers[known[0]], player
 
         return None, None
 
@@ -1,7 +1,10 @@
+import copy
 import random
 
+import numpy as np
 from enum import Enum
 from mlsolver.formula import *
+from mlsolver.model import CountingMafia, RoleConstraint, RolePositions
 
 class Roles(Enum):
     VILLAGER = 0
@@ -9,16 +12,25 @@ class Roles(Enum):
     DOCTOR = 2
     INFORMANT = 3
 
+# The value of the role for each ASCII code of a role letter
+LETTER_CODES = np.full(256, -1, dtype=np.int64)
+for role in Roles:
+    LETTER_CODES[ord(role.name[0])] = role.value
+ROLE_LETTERS = [role.name[0] for role in Roles]
+
 class Player:
     def __init__(self, name="Player"):
         self.role = None
         self.alivePlayers = []
         self.players = []
         self.deadPlayers = []
-        self.playerBeliefs = []  # List of tuples (player, list of beliefs)
+        self.beliefs = np.zeros((0, len(Roles)), dtype=bool)  # Whether each player may have each role
+        self.roleCounts = np.zeros((0, len(Roles)), dtype=np.int64)  # Accessible worlds per player and role
         self.name = name
         self.player_id = None # Will be set by MafiaGame
         self.model = None # Will be set by MafiaGame
+        self.game = None # Will be set by MafiaGame
+        self.rng = random.Random() # Replaced by the generator of the game
         self.currentWorld = None # Will be set by MafiaGame
 
     def print_state(self):
@@ -28,7 +40,32 @@ class Player:
         for belief in self.playerBeliefs:
             print(f"{belief[0].name}: {belief[1]}, " + ("dead" if belief[0] not in self.alivePlayers else "alive"))
         print("")
+
+    @property
+    def beliefMatrix(self):
+        # Events that the game still batches have to be applied before beliefs are read
+        if self.game is not None:
+            self.game.applyEvents()
+        return self.beliefs
+
+    @property
+    def playerBeliefs(self):
+        # Read-only view as tuples (player, names of the possible roles in the order of Roles)
+        return tuple((player, [role.name for role in Roles if possible[role.value]])
+                     for player, possible in zip(self.players, self.beliefMatrix))
+
+    def aliveMask(self):
+        alive = np.zeros(len(self.players), dtype=bool)
+        alive[[player.player_id for player in self.alivePlayers]] = True
+        return alive
         
+    def fork(self):
+        # Copy for a fork of the game, which sets the references to the game and other
+        # players. The belief arrays are only ever replaced, so they are shared.
+        forked = copy.copy(self)
+        forked.accusations = dict(self.accusations)
+        return forked
+
     def convertLetterToRole(self, letter):
         for role in Roles:
             if role.name[0] == letter:
@@ -41,65 +78,95 @@ class Player:
         self.readKripkeModel()
         
     def vote(self):
-        suspected_mafioso = [belief[0] for belief in self.playerBeliefs if
-                             (belief[0] in self.alivePlayers and ["MAFIOSO"] == belief[1])]
-        if suspected_mafioso:
-            return suspected_mafioso[0]
+        beliefs = self.beliefMatrix
+        possibleMafioso = self.aliveMask() & beliefs[:, Roles.MAFIOSO.value]
+        suspected_mafioso = np.flatnonzero(possibleMafioso & (beliefs.sum(axis=1) == 1))
+        if suspected_mafioso.size:
+            return self.players[suspected_mafioso[0]]
 
-        candidates = [belief[0] for belief in self.playerBeliefs if
-                      (belief[0] in self.alivePlayers and "MAFIOSO" in belief[1])]
+        candidates = [self.players[num] for num in np.flatnonzero(possibleMafioso)]
         # Vote for a random possible mafioso
-        return random.choice(candidates)
+        return self.rng.choice(candidates)
 
     def die(self):
         roleLetter = self.role.name[0]
-        for player in self.alivePlayers:
-            newRelations = set()
-            for relation in self.model.ks.relations[str(player.player_id)]:
-                if relation[1][self.player_id] == roleLetter:
-                    newRelations.add(relation)
-            self.model.ks.relations[str(player.player_id)] = newRelations
-            player.readKripkeModel()
+        self.tell(RoleConstraint(self.player_id, roleLetter), self.alivePlayers)
 
     def updateKnowledge(self):
-        for player in self.alivePlayers:
-            player.updateRelations(lambda relation: relation[1][self.player_id] != 'M')
+        self.tell(RoleConstraint(self.player_id, 'M', has=False), self.alivePlayers)
 
     def revealPlayerID(self):
-        for player in self.alivePlayers:
-            player.updateRelations(lambda relation: relation[1][self.player_id] == self.role.name[0])
+        roleLetter = self.role.name[0]
+        self.tell(RoleConstraint(self.player_id, roleLetter), self.alivePlayers)
+
+    def tell(self, predicate, recipients):
+        # Through the game, so that the event is queued while the game batches events
+        if self.game is None:
+            for player in recipients:
+                player.restrictRelations(predicate)
+        else:
+            self.game.announce(predicate, recipients)
             
-    def updateRelations(self, func):
-        newRelations = set()
-        for relation in self.model.ks.relations[str(self.player_id)]:
-            if func(relation):
-                newRelations.add(relation)
-        self.model.ks.relations[str(self.player_id)] = newRelations
-        self.readKripkeModel()
+    def restrictRelations(self, predicate):
+        # Only keep the relations to worlds that satisfy the predicate
+        before = self.accessibleWorlds()
+        self.model.ks.restrict_relation(str(self.player_id), predicate)
+        self.updateBeliefs(before)
+
+    def refineRelations(self, key):
+        # Only keep the relations between worlds that have the same key
+        before = self.accessibleWorlds()
+        self.model.ks.refine_relation(str(self.player_id), key)
+        self.updateBeliefs(before)
+
+    def accessibleWorlds(self):
+        if isinstance(self.model, CountingMafia):
+            # The counting abstraction does not enumerate worlds
+            return None
+        worlds = self.model.ks.successors(self.currentWorld, str(self.player_id))
+        # Relations of sets may change their successor sets in place
+        return worlds if isinstance(worlds, frozenset) else frozenset(worlds)
         
-    def mafiaMembersKnown(self, relation):
-        for location in range(len(relation[0])):
-            if relation[0][location] == 'M' and relation[1][location] != 'M':
-                return False
-        return True
-        
-    def doctorsKnown(self, relation):
-        for location in range(len(relation[0])):
-            if relation[0][location] == 'D' and relation[1][location] != 'D':
-                return False
-        return True
-    
+    def knows(self, formula):
+        # Evaluated through the model's cache, so asking again in the same round is cheap
+        if self.game is not None:
+            self.game.applyEvents()
+        if isinstance(self.model, CountingMafia):
+            return self.model.ks.knows(str(self.player_id), formula)
+        return Box_a(str(self.player_id), formula).semantic(self.model.ks, self.currentWorld)
+
     def readKripkeModel(self):
-        num_players = len(self.currentWorld)
-        self.playerBeliefs = []
-        for player in self.players:
-            self.playerBeliefs.append((player, []))
-        for relation in self.model.ks.relations[str(self.player_id)]:
-            if self.currentWorld == relation[0]:
-                for num, role in enumerate(relation[1]):
-                    actualRole = self.convertLetterToRole(role)
-                    if actualRole.name not in self.playerBeliefs[num][1]:
-                        self.playerBeliefs[num][1].append(actualRole.name)
+        if isinstance(self.model, CountingMafia):
+            self.beliefs = self.model.ks.possible_roles(str(self.player_id), ROLE_LETTERS)
+            return
+        self.roleCounts = np.zeros((len(self.players), len(Roles)), dtype=np.int64)
+        self.countWorlds(self.accessibleWorlds(), 1)
+        self.updateBeliefMatrix()
+
+    def updateBeliefs(self, before):
+        # The relations only ever lose edges, so only the worlds that are no
+        # longer accessible have to be subtracted from the counts
+        if before is None:
+            self.readKripkeModel()
+            return
+        after = self.accessibleWorlds()
+        if len(after) == len(before):
+            return
+        self.countWorlds([world for world in before if world not in after], -1)
+        self.updateBeliefMatrix()
+
+    def countWorlds(self, worlds, sign):
+        if not worlds:
+            return
+        # One row of role values per world
+        codes = LETTER_CODES[np.frombuffer(''.join(worlds).encode('ascii'), dtype=np.uint8)]
+        codes = codes.reshape(len(worlds), len(self.players))
+        # Replaced instead of changed in place, as forks of the game share it
+        self.roleCounts = self.roleCounts + sign * (codes[:, :, np.newaxis] == np.arange(len(Roles))).sum(axis=0)
+
+    def updateBeliefMatrix(self):
+        # A player may have a role iff some accessible world supports it
+        self.beliefs = self.roleCounts > 0
 
 class Villager(Player):
     def __init__(self):
@@ -114,6 +181,7 @@ class Informant(Villager):
     def __init__(self):
         super().__init__()
         self.role = Roles.INFORMANT
+        self.target = None # The mafioso this informant knows about
 
     def initializeBeliefs(self, target=None):
         # Informants know who one of the mafiosi is
@@ -123,9 +191,10 @@ class Informant(Villager):
                 print("No mafiosi for the informant to know about!")
                 super().initializeBeliefs(model, currentWorld)
                 return
-            target = random.choice(mafiosi)
+            target = self.rng.choice(mafiosi)
+        self.target = target
         super().initializeBeliefs()
-        self.updateRelations(lambda relation: relation[1][target.player_id] == 'M')
+        self.restrictRelations(RoleConstraint(target.player_id, 'M'))
 
 class Mafioso(Player):
     def __init__(self):
@@ -136,13 +205,13 @@ class Mafioso(Player):
         # Mafiosi know who the other mafiosi are.
         # Therfore, update this mafioso's accessibility relations.
         super().initializeBeliefs()
-        self.updateRelations(self.mafiaMembersKnown)
+        self.refineRelations(RolePositions('M'))
 
     def vote(self):
-        candidates = [belief[0] for belief in self.playerBeliefs if
-                      (belief[0] in self.alivePlayers and "MAFIOSO" not in belief[1])]
+        notMafioso = self.aliveMask() & ~self.beliefMatrix[:, Roles.MAFIOSO.value]
+        candidates = [self.players[num] for num in np.flatnonzero(notMafioso)]
         # Vote for a random villager who is not in the mafia
-        return random.choice(candidates)
+        return self.rng.choice(candidates)
 
 class Doctor(Villager):
     def __init__(self):
@@ -152,8 +221,8 @@ class Doctor(Villager):
     def initializeBeliefs(self):
         # Doctors know who the other Doctors are
         super().initializeBeliefs()
-        self.updateRelations(self.doctorsKnown)
+        self.refineRelations(RolePositions('D'))
 
     def changeDoctorsKnowledge(self, villager):
         # After saving a player from the night phase, update the knowledge that he is innocent
-        self.updateRelations(lambda relation: relation[1][villager.player_id] != 'M')
+        self.tell(RoleConstraint(villager.player_id, 'M', has=False), [self])
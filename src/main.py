@@ -10,7 +10,7 @@ from matplotlib.figure import Figure
 import networkx as nx
 
 from belief_graph import BeliefGraph
-from mafia_model import MafiaGame
+from game_runner import GameRunner
 
 class MainWindow(QMainWindow):
     def __init__(self, villagers=10, mafiosi=2, doctors=1, informants=1,
@@ -28,9 +28,9 @@ class MainWindow(QMainWindow):
         self.informant_strategy = informant_strategy
         self.doctors_strategy = doctors_strategy
         self.num_protectedPlayers = num_protectedPlayers
+        self.runner = None
         self.game = None
         self.belief_graph = None
-        self.votes = None
         self.totalPlayers = 0
         self.round = 0
         self.informant_enabled = informant_enabled
@@ -85,8 +85,12 @@ class MainWindow(QMainWindow):
         self.timer.timeout.connect(self.playMafia)
 
     def start_game(self):
-        self.game = MafiaGame(villagers=self.villagers, mafiosi=self.mafiosi, doctors=self.doctors,
-                              informants=self.informants)
+        self.runner = GameRunner(villagers=self.villagers, mafiosi=self.mafiosi, doctors=self.doctors,
+                                 informants=self.informants, mafia_strategy=self.mafia_strategy,
+                                 informant_strategy=self.informant_strategy, doctors_strategy=self.doctors_strategy,
+                                 num_protectedPlayers=self.num_protectedPlayers,
+                                 informant_enabled=self.informant_enabled, observer=self.onGameEvent, verbose=True)
+        self.game = self.runner.game
         self.totalPlayers = len(self.game.players)
         self.belief_graph = BeliefGraph(self.game)
         self.playMafia()
@@ -157,139 +161,22 @@ class MainWindow(QMainWindow):
         self.timer.start(500)
 
     def playMafia(self):
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-
-        self.round += 1
-        self.game_log.append(f"\n\n=== Round {self.round} ===\n\n")
-
-        for player in self.game.alivePlayers:
-            player.print_state()
-            player_status = f"{player.name} (Role: {player.role.name})\n"
-            self.game_log.append(player_status)
-        
-        win = self.game.checkWin()
-        if win:
-            QMessageBox.information(self, "Game Over", f"{win} win!")
-            self.timer.stop()
-            self.plot()
-            self.plots_layout.addWidget(scroll)
-            self.game_log.append(f"Game Over, {win} win!")
-            return
-
-        if self.round > 1:
-            self.plot()
-            self.plots_layout.addWidget(scroll)
-
-        # Perform a round of night phase
-        if len(self.game.alivePlayers) == self.totalPlayers:
-            # In the first round, always kill randomly a villager during the night phase
-            villager = self.game.voteVillager(mafia_strategy='random')
-        else:
-            # In the rest of the rounds, follow a certain strategy to kill
-            villager = self.game.voteVillager(mafia_strategy=self.mafia_strategy, votes=self.votes)
-
-        # Choose a player to protect after the night phase
-        protected = self.game.choose_protected_player()
-        print(f"The doctors, if present, choose to protect {protected.name}.")
-        # Check whether the player that was killed will be indeed saved
-        if 'DOCTOR' in [player.role.name for player in self.game.alivePlayers] and villager == protected:
-            if self.game.protectedID_is_known(protected):
-                print(f"{villager.name} was saved by the Doctor(s) after the night phase, but it is already common "
-                      f"knowledge that he is innocent!\n")
-            else:
-                self.game.savePlayer(protected)
-                print(f"{villager.name} was saved by the Doctor(s) after the night phase!\n")
-        else:
-            # Either the Doctor is not active, or the protected player is not the one that was killed
-            # Kill the innocent player and update the model
-            self.game.kill(villager)
-        self.game_log.append(f"{villager.name} was killed during the night phase!\n")
-
-        if 'DOCTOR' in [player.role.name for player in self.game.alivePlayers]:
-            # For this round, decide whether Doctor(s) will let the rest players know about their identity and knowledge
-            self.game.apply_doctors_strategy(doctors_strategy=self.doctors_strategy,
-                                             num_protectedPLayers=self.num_protectedPlayers)
-
-        # The mafiosi might win the game by killing a villager at night
-        win = self.game.checkWin()
-        if win:
-            QMessageBox.information(self, "Game Over", f"{win} win!")
-            self.timer.stop()
-            self.game_log.append(f"Game Over, {win} win!")
-            self.plot()
-            self.plots_layout.addWidget(scroll)
-            return
-        
-        elif len(self.game.alivePlayers) <= 2:
-            QMessageBox.information(self, "Game Over", "Tie!")
-            self.timer.stop()
-            self.game_log.append(f"Game Over, Tie!")
+        # Play one round per timer tick, the runner reports what happens to onGameEvent
+        if self.runner.playRound() is None:
+            self.start_timer()
+
+    def onGameEvent(self, event, text):
+        if event == 'log':
+            self.game_log.append(text)
+        elif event == 'snapshot':
+            self.round = self.runner.round
+            scroll = QScrollArea()
+            scroll.setWidgetResizable(True)
             self.plot()
             self.plots_layout.addWidget(scroll)
-
-            return
-        
-        # Check whether the Informant will reveal the identity of the one known mafia member
-        if self.informant_enabled and not self.game.revealedMafioso:
-            self.game.apply_informant_strategy(informant_strategy=self.informant_strategy)
-
-        # Perform a round of day phase
-        voteCount = {}
-        self.votes = {}
-        for player in self.game.alivePlayers:
-            # Open vote for the player to be eliminated
-            vote = player.vote()
-            self.game_log.append(f"{player.name} votes to eliminate {vote.name}")
-            if vote in voteCount:
-                voteCount[vote] += 1
-            else:
-                voteCount[vote] = 1
-
-            if vote.role.name == 'MAFIOSO':
-                # Keep track of the votes against true Mafia members
-                player.suspectMafioso(vote)
-                self.votes[player] = 1
-            else:
-                self.votes[player] = 0
-
-        # Find the player with the majority of votes to be eliminated during the day phase
-        maxVote = 0
-        maxPlayer = None
-        for player in voteCount:
-            if voteCount[player] > maxVote:
-                maxVote = voteCount[player]
-                maxPlayer = player
-        self.game_log.append(f"{maxPlayer.name} is eliminated!\n")
-        # Kill the player and update the model
-        self.game.kill(maxPlayer)
-
-        for player in self.game.players:
-            self.game_log.append(f"{player.name} correctly suspects {player.accusations}")
-        
-        if maxPlayer.role.name == 'MAFIOSO':
-            # Update players' beliefs if a Mafia member is eliminated
-            for player in self.game.players:
-                if player.accusations[maxPlayer.name] >= 1:
-                    self.game_log.append(f"{player.name} correctly suspected {maxPlayer.name}!")
-                    player.updateKnowledge()
-
-        self.game_log.append("---------------------------------------------------------------------------------------------------\n")
-
-        win = self.game.checkWin()
-        if win:
-            QMessageBox.information(self, "Game Over", f"{win} win!")
+        elif event == 'end':
+            QMessageBox.information(self, "Game Over", "Tie!" if text == 'Tie' else f"{text} win!")
             self.timer.stop()
-            self.game_log.append(f"Game Over, {win} win!")
-            self.plot()
-            self.plots_layout.addWidget(scroll)
-            return
-
-        if self.round == 1:
-            self.plot()
-            self.plots_layout.addWidget(scroll)
-
-        self.start_timer()
          
 if __name__ == '__main__':
     """ mafia_strategy = {enemy, allied, random}
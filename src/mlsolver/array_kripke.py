@@ -0,0 +1,168 @@
+"""Array Kripke module
+
+Provides a Kripke structure for role assignments, that keeps its worlds and
+accessibility relations in NumPy arrays, and conversions from and to the
+string based KripkeStructure.
+"""
+
+from math import factorial
+
+import numpy as np
+
+from mlsolver.kripke import KripkeStructure, PartitionRelation, World
+from mlsolver.model import generate_role_assignments
+
+
+class ArrayKripkeStructure:
+    """
+    This class describes a Kripke structure whose worlds are rows of small
+    integer role codes, one column per player, so that a world id is simply
+    a row index. The relation of each agent is stored as a block label per
+    world and a boolean matrix, that holds for each block the worlds it
+    reaches. World (i, j) is an edge of the agent iff reach[labels[i], j].
+    """
+
+    def __init__(self, roles, letters, relations=None):
+        self.roles = roles
+        self.letters = tuple(letters)
+        self.alive = np.ones(len(roles), dtype=bool)
+        self.names = [''.join(self.letters[code] for code in row) for row in roles]
+        self.index_by_name = {name: index for index, name in enumerate(self.names)}
+        if relations is None:
+            relations = {str(player): self.role_partition(player) for player in range(roles.shape[1])}
+        self.relations = relations
+
+    @classmethod
+    def from_roles(cls, roles):
+        """Returns the structure of all assignments of roles, e.g.
+        {"mafiosi": 2, "villagers": 7}, where each player only knows their
+        own role.
+        """
+        count = factorial(sum(roles.values()))
+        for role_count in roles.values():
+            count //= factorial(role_count)
+        codes = {role: code for code, role in enumerate(roles)}
+        world_roles = np.empty((count, sum(roles.values())), dtype=np.int8)
+        for index, world in enumerate(generate_role_assignments(roles)):
+            world_roles[index] = [codes[role] for role in world]
+        return cls(world_roles, [role[0].upper() for role in roles])
+
+    @classmethod
+    def from_kripke(cls, ks):
+        """Returns the array representation of a Kripke structure, whose
+        world names hold one role letter per player.
+        """
+        letters = []
+        for world in ks.worlds:
+            for letter in world.name:
+                if letter not in letters:
+                    letters.append(letter)
+        codes = {letter: code for code, letter in enumerate(letters)}
+        world_roles = np.array([[codes[letter] for letter in world.name] for world in ks.worlds],
+                               dtype=np.int8)
+        structure = cls(world_roles, letters, {})
+        for agent, relation in ks.relations.items():
+            structure.relations[agent] = structure._relation_from_edges(relation)
+        return structure
+
+    def to_kripke(self):
+        """Returns the KripkeStructure with the same worlds and relations.
+        """
+        worlds = [World(self.names[index], {f'{num}:{letter}': True for num, letter in enumerate(self.names[index])})
+                  for index in np.flatnonzero(self.alive)]
+        relations = {}
+        for agent, (labels, reach) in self.relations.items():
+            blocks = [frozenset(self.names[index] for index in np.flatnonzero(row)) for row in reach]
+            relations[agent] = PartitionRelation({self.names[index]: blocks[label]
+                                                  for index, label in enumerate(labels)
+                                                  if label >= 0 and blocks[label]})
+        return KripkeStructure(worlds, relations)
+
+    def _relation_from_edges(self, relation):
+        successors = {}
+        if isinstance(relation, PartitionRelation):
+            successors = relation.successors_by_world
+        else:
+            for (start_node, end_node) in relation:
+                successors.setdefault(start_node, set()).add(end_node)
+        labels = np.full(len(self.names), -1, dtype=np.int64)
+        block_labels = {}
+        rows = []
+        for start_node, ends in successors.items():
+            block = frozenset(ends)
+            if block not in block_labels:
+                row = np.zeros(len(self.names), dtype=bool)
+                row[[self.index_by_name[name] for name in block]] = True
+                block_labels[block] = len(rows)
+                rows.append(row)
+            labels[self.index_by_name[start_node]] = block_labels[block]
+        reach = np.array(rows, dtype=bool).reshape(len(rows), len(self.names))
+        return labels, reach
+
+    def role_partition(self, player):
+        """Returns the relation of a player, that only knows their own role.
+        """
+        labels = self.roles[:, player].astype(np.int64)
+        reach = labels[np.newaxis, :] == np.arange(len(self.letters))[:, np.newaxis]
+        return labels, reach
+
+    def index_of(self, name):
+        """Returns the id of the world with the given name, or None if there
+        is no such world.
+        """
+        index = self.index_by_name.get(name)
+        if index is None or not self.alive[index]:
+            return None
+        return index
+
+    def worlds_where(self, player, letter):
+        """Returns the mask of worlds, where player has the role with the
+        given letter.
+        """
+        return (self.roles[:, player] == self.letters.index(letter)) & self.alive
+
+    def role_positions_key(self, letter):
+        """Returns one key per world, that is equal for two worlds iff the same
+        players have the role with the given letter.
+        """
+        _, keys = np.unique(self.roles == self.letters.index(letter), axis=0, return_inverse=True)
+        return keys.reshape(-1)
+
+    def successors(self, agent, world):
+        """Returns the ids of the worlds that agent considers possible in the
+        world with the given id.
+        """
+        labels, reach = self.relations[agent]
+        if labels[world] < 0:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(reach[labels[world]])
+
+    def restrict_relation(self, agent, mask):
+        """Keeps only the edges of agent, whose end node is in the mask.
+        """
+        labels, reach = self.relations[agent]
+        self.relations[agent] = (labels, reach & mask)
+
+    def refine_relation(self, agent, keys):
+        """Keeps only the edges of agent between worlds with equal keys.
+        """
+        labels, reach = self.relations[agent]
+        has_block = labels >= 0
+        pairs, inverse = np.unique(np.stack([labels[has_block], keys[has_block]], axis=1),
+                                   axis=0, return_inverse=True)
+        refined_labels = np.full(len(labels), -1, dtype=np.int64)
+        refined_labels[has_block] = inverse.reshape(-1)
+        refined_reach = reach[pairs[:, 0]] & (keys[np.newaxis, :] == pairs[:, 1][:, np.newaxis])
+        self.relations[agent] = (refined_labels, refined_reach)
+
+    def remove_worlds(self, mask):
+        """Removes the worlds in the mask together with all their edges.
+        """
+        self.alive &= ~mask
+        for agent, (labels, reach) in self.relations.items():
+            labels = labels.copy()
+            labels[mask] = -1
+            self.relations[agent] = (labels, reach & ~mask)
+
+    def __str__(self):
+        return str(self.to_kripke())
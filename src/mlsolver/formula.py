@@ -1,10 +1,86 @@
 """Modal logic formula module
 
 This module unites all operators from propositional and modal logic.
+Formulas are immutable and interned: creating a formula that is
+structurally equal to an existing one returns the existing instance, so
+formulas can be hashed and used as cache keys.
 """
 
+import functools
+import inspect
+import weakref
 
-class Atom:
+
+class Interned(type):
+    """
+    Metaclass of all formulas, that returns the existing instance if a
+    formula with the same arguments was already created.
+    """
+
+    _instances = weakref.WeakValueDictionary()
+    _signatures = {}
+
+    def __call__(cls, *args, **kwargs):
+        signature = Interned._signatures.get(cls)
+        if signature is None:
+            signature = Interned._signatures[cls] = inspect.signature(cls.__init__)
+        bound = signature.bind(None, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = tuple(bound.arguments.values())[1:]
+        key = (cls, arguments)
+        formula = Interned._instances.get(key)
+        if formula is None:
+            formula = super().__call__(*arguments)
+            object.__setattr__(formula, '_args', arguments)
+            object.__setattr__(formula, '_hash', hash((cls.__name__, arguments)))
+            Interned._instances[key] = formula
+        return formula
+
+
+class Formula(metaclass=Interned):
+    """
+    Base class of all operators. Formulas are equal iff they have the same
+    type and equal arguments, and cannot be changed once they are created.
+    """
+
+    def __setattr__(self, name, value):
+        if '_hash' in self.__dict__:
+            raise AttributeError(f"{type(self).__name__} formulas are immutable")
+        super().__setattr__(name, value)
+
+    def __eq__(self, other):
+        return self is other or (type(self) is type(other) and self._args == other._args)
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return type(self), self._args
+
+
+def cached_semantic(semantic):
+    """Decorates semantic(), so that results are looked up in and stored to
+    the evaluation cache of the Kripke structure, keyed by formula, world
+    and version of the structure. Only the modal operators are cached, as
+    the propositional ones cost less than a lookup in the cache.
+    """
+
+    @functools.wraps(semantic)
+    def cached(self, ks, world_to_test):
+        cache = getattr(ks, 'evaluation_cache', None)
+        if cache is None:
+            return semantic(self, ks, world_to_test)
+        key = (self, world_to_test, ks.version)
+        result = cache.get(key, cache)
+        if result is cache:
+            result = semantic(self, ks, world_to_test)
+            cache.put(key, result)
+        return result
+
+    return cached
+
+
+class Atom(Formula):
     """
     This class represents propositional logic variables in modal logic formulas.
     """
@@ -15,18 +91,21 @@ class Atom:
     def semantic(self, ks, world_to_test):
         """Function returns assignment of variable in Kripke's world.
         """
-        for world in ks.worlds:
-            if world.name == world_to_test:
-                return world.assignment.get(self.name, False)
+        world = ks.get_world(world_to_test)
+        if world is not None:
+            return world.assignment.get(self.name, False)
 
-    def __eq__(self, other):
-        return isinstance(other, Atom) and other.name == self.name
+    def extension(self, ks):
+        """Function returns the set of names of the worlds, where the variable
+        is true.
+        """
+        return frozenset(world.name for world in ks.worlds if world.assignment.get(self.name, False))
 
     def __str__(self):
         return str(self.name)
 
 
-class Box:
+class Box(Formula):
     """
     Describes box operator of modal logic formula and it's semantics
     """
@@ -34,15 +113,12 @@ class Box:
     def __init__(self, inner):
         self.inner = inner
 
+    @cached_semantic
     def semantic(self, ks, world_to_test):
-        result = True
-        for relation in ks.relations:
-            if relation[0] == world_to_test:
-                result = result and self.inner.semantic(ks, relation[1])
-        return result
+        return all(self.inner.semantic(ks, world) for world in ks.successors(world_to_test))
 
-    def __eq__(self, other):
-        return isinstance(other, Box) and self.inner == other.inner
+    def extension(self, ks):
+        return box_extension(ks, self.inner.extension(ks))
 
     def __str__(self):
         if isinstance(self.inner, Atom):
@@ -51,7 +127,7 @@ class Box:
             return u"\u2610" + "(" + str(self.inner) + ")"
 
 
-class Box_a:
+class Box_a(Formula):
     """
     Describes box operator of modal logic formula and it's semantics for Agent a
     """
@@ -60,48 +136,56 @@ class Box_a:
         self.inner = inner
         self.agent = agent
 
+    @cached_semantic
     def semantic(self, ks, world_to_test):
-        result = True
-        for relation in ks.relations.get(self.agent, {}):
-            if relation[0] == world_to_test:
-                result = result and self.inner.semantic(ks, relation[1])
-        return result
+        return all(self.inner.semantic(ks, world) for world in ks.successors(world_to_test, self.agent))
 
-    # TODO
-    def __eq__(self, other):
-        raise NotImplementedError
+    def extension(self, ks):
+        return box_extension(ks, self.inner.extension(ks), self.agent)
 
-    # TODO
     def __str__(self):
         return f"{self.agent} knows {self.inner}"
 
 
-class Box_star:
+class Box_star(Formula):
     """
-    Describes semantic of multi modal Box^* operator.
-    Semantic(Box_star phi) = min(Box Box ... Box phi, for all n in /N)
-    Simplification with n = 1: Box_star phi = phi and Box_a phi and Box_b phi ... and Box_n phi
+    Describes semantic of multi modal Box^* operator (common knowledge).
+    Semantic(Box_star phi) = min(Box Box ... Box phi, for all n in /N), where
+    Box follows the relation of any agent, i.e. phi holds in every world
+    that is reachable in any number of steps. With a depth, only the worlds
+    reachable in at most depth steps are considered ("everybody knows" up to
+    that depth); depth 1 gives phi and Box_a phi and Box_b phi ... and Box_n phi
     """
 
-    def __init__(self, inner):
+    def __init__(self, inner, depth=None):
         self.inner = inner
+        self.depth = depth
 
-    def semantic(self, ks, world_to_test, depth=1):
-        f = self.inner
-        for agents in ks.relations:
-            f = And(f, Box_a(agents, self.inner))
-        return f.semantic(ks, world_to_test)
-
-    # TODO
-    def __eq__(self, other):
-        raise NotImplementedError
+    @cached_semantic
+    def semantic(self, ks, world_to_test):
+        return all(self.inner.semantic(ks, world) for world in ks.reachable(world_to_test, self.depth))
+
+    def extension(self, ks):
+        inner_extension = self.inner.extension(ks)
+        if self.depth is None:
+            return ks.get_reachability().closed_extension(inner_extension)
+        extension = inner_extension
+        for _ in range(self.depth):
+            everybody_knows = extension
+            for agent in ks.agents():
+                everybody_knows = everybody_knows & box_extension(ks, extension, agent)
+            extension = inner_extension & everybody_knows
+        return extension
 
-    # TODO
     def __str__(self):
-        raise NotImplementedError
+        depth = "" if self.depth is None else str(self.depth)
+        if isinstance(self.inner, Atom):
+            return u"\u2610" + "*" + depth + " " + str(self.inner)
+        else:
+            return u"\u2610" + "*" + depth + "(" + str(self.inner) + ")"
 
 
-class Diamond:
+class Diamond(Formula):
     """
     Describes diamond operator of modal logic formula and it's semantics
     """
@@ -109,15 +193,12 @@ class Diamond:
     def __init__(self, inner):
         self.inner = inner
 
+    @cached_semantic
     def semantic(self, ks, world_to_test):
-        result = False
-        for relation in ks.relations:
-            if relation[0] == world_to_test:
-                result = result or self.inner.semantic(ks, relation[1])
-        return result
+        return any(self.inner.semantic(ks, world) for world in ks.successors(world_to_test))
 
-    def __eq__(self, other):
-        return isinstance(other, Diamond) and self.inner == other.inner
+    def extension(self, ks):
+        return diamond_extension(ks, self.inner.extension(ks))
 
     def __str__(self):
         if isinstance(self.inner, Atom):
@@ -126,7 +207,7 @@ class Diamond:
             return u"\u25C7" + "(" + str(self.inner) + ")"
 
 
-class Diamond_a:
+class Diamond_a(Formula):
     """
     Describes diamond operator of modal logic formula and it's semantics for Agent a
     """
@@ -135,23 +216,18 @@ class Diamond_a:
         self.inner = inner
         self.agent = agent
 
+    @cached_semantic
     def semantic(self, ks, world_to_test):
-        result = False
-        for relation in ks.relations.get(self.agent, {}):
-            if relation[0] == world_to_test:
-                result = result or self.inner.semantic(ks, relation[1])
-        return result
+        return any(self.inner.semantic(ks, world) for world in ks.successors(world_to_test, self.agent))
 
-    # TODO
-    def __eq__(self, other):
-        raise NotImplementedError
+    def extension(self, ks):
+        return diamond_extension(ks, self.inner.extension(ks), self.agent)
 
-    # TODO
     def __str__(self):
-        raise NotImplementedError
+        return f"{self.agent} considers {self.inner} possible"
 
 
-class Implies:
+class Implies(Formula):
     """
     Describes implication derived from classic propositional logic
     """
@@ -163,14 +239,14 @@ class Implies:
     def semantic(self, ks, world_to_test):
         return not self.left.semantic(ks, world_to_test) or self.right.semantic(ks, world_to_test)
 
-    def __eq__(self, other):
-        return self.left == other.left and self.right == other.right
+    def extension(self, ks):
+        return world_names(ks).difference(self.left.extension(ks)) | self.right.extension(ks)
 
     def __str__(self):
         return "(" + self.left.__str__() + " -> " + self.right.__str__() + ")"
 
 
-class Not:
+class Not(Formula):
     """
     Describes negation derived from classic propositional logic
     """
@@ -181,14 +257,14 @@ class Not:
     def semantic(self, ks, world_to_test):
         return not self.inner.semantic(ks, world_to_test)
 
-    def __eq__(self, other):
-        return self.inner == other.inner
+    def extension(self, ks):
+        return world_names(ks).difference(self.inner.extension(ks))
 
     def __str__(self):
         return u"\uFFE2" + str(self.inner)
 
 
-class And:
+class And(Formula):
     """
     Describes and derived from classic propositional logic
     """
@@ -200,14 +276,14 @@ class And:
     def semantic(self, ks, world_to_test):
         return self.left.semantic(ks, world_to_test) and self.right.semantic(ks, world_to_test)
 
-    def __eq__(self, other):
-        return self.left == other.left and self.right == other.right
+    def extension(self, ks):
+        return self.left.extension(ks) & self.right.extension(ks)
 
     def __str__(self):
         return "(" + self.left.__str__() + " " + u"\u2227" + " " + self.right.__str__() + ")"
 
 
-class Or:
+class Or(Formula):
     """
     Describes or derived from classic propositional logic
     """
@@ -219,8 +295,67 @@ class Or:
     def semantic(self, ks, world_to_test):
         return self.left.semantic(ks, world_to_test) or self.right.semantic(ks, world_to_test)
 
-    def __eq__(self, other):
-        return self.left == other.left and self.right == other.right
+    def extension(self, ks):
+        return self.left.extension(ks) | self.right.extension(ks)
 
     def __str__(self):
         return "(" + self.left.__str__() + " " + u"\u2228" + " " + self.right.__str__() + ")"
+
+
+def is_existential(formula, positive=True):
+    """Returns whether the formula (or its negation, if not positive) has
+    only diamonds as modal operators once negations are pushed inwards.
+    Such a formula that is false in a world stays false when other worlds
+    are removed, so announcing it removes the same worlds as the search for
+    the largest sub model, in which it holds everywhere.
+    """
+    if isinstance(formula, Atom):
+        return True
+    if isinstance(formula, Not):
+        return is_existential(formula.inner, not positive)
+    if isinstance(formula, (And, Or)):
+        return is_existential(formula.left, positive) and is_existential(formula.right, positive)
+    if isinstance(formula, Implies):
+        return is_existential(formula.left, not positive) and is_existential(formula.right, positive)
+    if isinstance(formula, (Diamond, Diamond_a)):
+        return positive and is_existential(formula.inner, positive)
+    if isinstance(formula, (Box, Box_a, Box_star)):
+        return not positive and is_existential(formula.inner, positive)
+    return False
+
+
+def world_names(ks):
+    """Returns the set of names of all worlds of a Kripke structure.
+    """
+    return frozenset(world.name for world in ks.worlds)
+
+
+def box_extension(ks, inner_extension, agent=None):
+    """Returns the set of names of the worlds, whose successors all lie in
+    inner_extension. Worlds that share one successor set are checked once.
+    """
+    checked = {}
+    extension = []
+    for world in ks.worlds:
+        successors = ks.successors(world.name, agent)
+        if id(successors) not in checked:
+            checked[id(successors)] = (successors, inner_extension.issuperset(successors))
+        if checked[id(successors)][1]:
+            extension.append(world.name)
+    return frozenset(extension)
+
+
+def diamond_extension(ks, inner_extension, agent=None):
+    """Returns the set of names of the worlds, that have at least one
+    successor in inner_extension. Worlds that share one successor set are
+    checked once.
+    """
+    checked = {}
+    extension = []
+    for world in ks.worlds:
+        successors = ks.successors(world.name, agent)
+        if id(successors) not in checked:
+            checked[id(successors)] = (successors, not inner_extension.isdisjoint(successors))
+        if checked[id(successors)][1]:
+            extension.append(world.name)
+    return frozenset(extension)
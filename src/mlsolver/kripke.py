@@ -5,9 +5,14 @@ modal logic formula.
 """
 
 import copy
+import functools
 
+from collections import OrderedDict
+from contextlib import contextmanager
 from itertools import chain, combinations
 
+from mlsolver.formula import is_existential
+
 
 class KripkeStructure:
     """
@@ -18,13 +23,191 @@ class KripkeStructure:
     def __init__(self, worlds, relations):
         if isinstance(worlds, list) or isinstance(worlds, dict):
             self.worlds = worlds
+            # Maps agent (None for a single relation) to the relation it was
+            # built from and a dict from world name to successor set.
+            self._successor_index = {}
+            self._world_by_name = None
+            self._reachability = None
+            # Formula results are cached per version, which is increased
+            # whenever the worlds or relations are changed by the methods of
+            # this class, or a relation is replaced or changed in place.
+            self.version = 0
+            self.evaluation_cache = EvaluationCache()
             self.relations = relations
         else:
             raise TypeError
 
+    @property
+    def relations(self):
+        """The relation, or the dict of relations by agent. The structure
+        keeps its own copies of sets that belong to another structure, and
+        notices when a relation is replaced or changed in place.
+        """
+        return self._relations
+
+    @relations.setter
+    def relations(self, relations):
+        if isinstance(relations, dict):
+            self._relations = RelationMap(self, relations)
+        else:
+            self._relations = self._track(None, relations)
+        self.mark_changed()
+
+    def _track(self, agent, relation):
+        """Returns the relation, or a copy of it if it belongs to another
+        structure, that reports its changes to this structure.
+        """
+        if isinstance(relation, (PartitionRelation, PointedRelation)):
+            if relation._on_change is not None:
+                relation = relation.fork()
+        elif not isinstance(relation, TrackedRelation) or relation._on_change is not None:
+            relation = TrackedRelation(relation)
+        relation._on_change = functools.partial(self._relation_changed, agent)
+        return relation
+
+    def _relation_changed(self, agent):
+        if not self._own_change:
+            self._successor_index.pop(agent, None)
+            self._changed()
+
+    _own_change = False
+
+    @contextmanager
+    def _changing_relations(self):
+        # The methods of this class update the successor index themselves
+        self._own_change = True
+        try:
+            yield
+        finally:
+            self._own_change = False
+            self._changed()
+
+    def mark_changed(self):
+        """Drops everything that was derived from the worlds and relations.
+        Changes to the relations are noticed by the structure, so this only
+        has to be called after changing the worlds directly.
+        """
+        self._successor_index = {}
+        self._world_by_name = None
+        self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self._reachability = None
+        self.evaluation_cache.clear()
+
+    def fork(self):
+        """Returns a copy of the structure, that can be changed without
+        changing this one. The worlds and the successor sets of the relations
+        are shared until either structure changes them.
+        """
+        forked = object.__new__(type(self))
+        forked.__dict__.update(self.__dict__)
+        forked._successor_index = {}
+        forked._reachability = None
+        forked.evaluation_cache = EvaluationCache(self.evaluation_cache.maxsize)
+        forked.relations = fork_relations(self.relations)
+        return forked
+
+    def __setstate__(self, state):
+        # The relations are pickled and copied as plain dicts and sets
+        relations = state.pop('_relations')
+        self.__dict__.update(state)
+        self.relations = relations
+
+    def get_world(self, name):
+        """Returns the world with the given name, or None if there is no
+        such world.
+        """
+        if self._world_by_name is None or len(self._world_by_name) != len(self.worlds):
+            worlds = self.worlds.values() if isinstance(self.worlds, dict) else self.worlds
+            self._world_by_name = {world.name: world for world in worlds}
+        return self._world_by_name.get(name)
+
+    def successors(self, world, agent=None):
+        """Returns the set of worlds, that are reachable from world by the
+        relation of agent, or by the only relation if agent is None. A dict
+        of relations may hold the relation of Box and Diamond at key None.
+        """
+        relations = self._relations
+        if isinstance(relations, dict):
+            relation = relations.get(agent)
+        else:
+            relation = relations if agent is None else None
+        if relation is None:
+            return frozenset()
+        if isinstance(relation, (PartitionRelation, PointedRelation)):
+            return relation.successors(world)
+        indexed_relation, index = self._successor_index.get(agent, (None, None))
+        if indexed_relation is not relation:
+            index = {}
+            for (start_node, end_node) in relation:
+                index.setdefault(start_node, set()).add(end_node)
+            self._successor_index[agent] = (relation, index)
+        return index.get(world, frozenset())
+
+    def agents(self):
+        """Returns the agents of the relations, or [None] if there is only
+        one relation.
+        """
+        if isinstance(self.relations, dict):
+            return list(self.relations)
+        return [None]
+
+    def reachable(self, world, depth=None):
+        """Returns the set of worlds, that are reachable from world in at
+        most depth steps (any number of steps if depth is None), where each
+        step follows the relation of any agent. The world itself is
+        reachable in zero steps.
+        """
+        return self.get_reachability().reachable(world, depth)
+
+    def get_reachability(self):
+        """Returns the reachability structure of the union of all relations.
+        It is built once and kept until the relations change.
+        """
+        signature = (self.version, len(self.worlds))
+        if self._reachability is None or self._reachability.signature != signature:
+            self._reachability = Reachability(self, signature)
+        return self._reachability
+
+    def _remove_from_successor_index(self, node_names):
+        for relation, index in self._successor_index.values():
+            for node_name in node_names:
+                index.pop(node_name, None)
+            for successors in index.values():
+                successors.difference_update(node_names)
+
     def solve(self, formula):
         """Returns a Kripke structure with minimum sub set of nodes, that each
-        of it's nodes forces a given formula.
+        of it's nodes forces a given formula. For formulas that removing
+        worlds cannot make true, see is_existential(), this is the result of
+        announce(), which takes polynomial time. Other formulas are solved by
+        solve_exhaustive().
+        """
+        if is_existential(formula):
+            return self.announce(formula)
+        return self.solve_exhaustive(formula)
+
+    def announce(self, formula):
+        """Returns the Kripke structure after publicly announcing formula:
+        all worlds that do not force the formula are removed, and this is
+        repeated on the smaller structure until every remaining world forces
+        it. Every round removes at least one world, so there are at most as
+        many rounds as worlds. For formulas with boxes, the result may have
+        fewer worlds than the one of solve().
+        """
+        ks = KripkeStructure(self.worlds.copy(), copy_relations(self.relations))
+        nodes_not_follow_formula = ks.nodes_not_follow_formula(formula)
+        while nodes_not_follow_formula:
+            ks.remove_nodes_by_name(nodes_not_follow_formula)
+            nodes_not_follow_formula = ks.nodes_not_follow_formula(formula)
+        return ks
+
+    def solve_exhaustive(self, formula):
+        """Returns a Kripke structure with minimum sub set of nodes, that each
+        of it's nodes forces a given formula. It tries every sub set of worlds
+        to remove, so it is only feasible for very small structures.
         """
         for i, subset in enumerate(self.get_power_set_of_worlds()):
             ks = KripkeStructure(self.worlds.copy(), copy.deepcopy(self.relations))
@@ -37,20 +220,87 @@ class KripkeStructure:
         """Removes ONE node of Kripke frame, therefore we can make knowledge
         base consistent with announcement.
         """
-        for world in self.worlds.copy():
-            if node_name == world.name:
-                self.worlds.remove(world)
-
-        if isinstance(self.relations, set):
-            for (start_node, end_node) in self.relations.copy():
-                if start_node == node_name or end_node == node_name:
-                    self.relations.remove((start_node, end_node))
+        world = self.get_world(node_name)
+        if world is not None:
+            # The list may be shared with a fork, so it is replaced instead of changed
+            self.worlds = [other for other in self.worlds if other is not world]
+            self._world_by_name = None
 
-        if isinstance(self.relations, dict):
-            for key, value in self.relations.items():
-                for (start_node, end_node) in value.copy():
+        with self._changing_relations():
+            if isinstance(self.relations, set):
+                for (start_node, end_node) in self.relations.copy():
                     if start_node == node_name or end_node == node_name:
-                        value.remove((start_node, end_node))
+                        self.relations.remove((start_node, end_node))
+
+            if isinstance(self.relations, dict):
+                for key, value in self.relations.items():
+                    if isinstance(value, (PartitionRelation, PointedRelation)):
+                        value.remove_world(node_name)
+                        continue
+                    for (start_node, end_node) in value.copy():
+                        if start_node == node_name or end_node == node_name:
+                            value.remove((start_node, end_node))
+            self._remove_from_successor_index({node_name})
+
+    def remove_nodes_by_name(self, node_names):
+        """Removes all given nodes of Kripke frame in one pass over the
+        relations.
+        """
+        node_names = set(node_names)
+        self.worlds = [world for world in self.worlds if world.name not in node_names]
+        self._world_by_name = None
+
+        with self._changing_relations():
+            if isinstance(self.relations, set):
+                self.relations.difference_update({(start_node, end_node) for (start_node, end_node) in self.relations
+                                                  if start_node in node_names or end_node in node_names})
+
+            if isinstance(self.relations, dict):
+                for key, value in self.relations.items():
+                    if isinstance(value, (PartitionRelation, PointedRelation)):
+                        value.remove_worlds(node_names)
+                        continue
+                    value.difference_update({(start_node, end_node) for (start_node, end_node) in value
+                                             if start_node in node_names or end_node in node_names})
+            self._remove_from_successor_index(node_names)
+
+    def restrict_relation(self, agent, predicate):
+        """Keeps only the edges of agent, whose end node satisfies predicate,
+        which is called with the name of that world.
+        """
+        relation = self.relations[agent]
+        self._successor_index.pop(agent, None)
+        self._changed()
+        if isinstance(relation, (PartitionRelation, PointedRelation)):
+            relation.restrict(predicate)
+        else:
+            self.relations[agent] = TrackedRelation((start_node, end_node) for (start_node, end_node) in relation
+                                                    if predicate(end_node))
+
+    def refine_relation(self, agent, key):
+        """Keeps only the edges of agent between worlds with the same key,
+        e.g. worlds that agree on the players that are mafiosi.
+        """
+        relation = self.relations[agent]
+        self._successor_index.pop(agent, None)
+        self._changed()
+        if isinstance(relation, (PartitionRelation, PointedRelation)):
+            relation.refine(key)
+        else:
+            self.relations[agent] = TrackedRelation((start_node, end_node) for (start_node, end_node) in relation
+                                                    if key(start_node) == key(end_node))
+
+    def filter_relation(self, agent, func):
+        """Keeps only the edges of agent, for which func returns true when it
+        is called with the edge as tuple of world names.
+        """
+        relation = self.relations[agent]
+        self._successor_index.pop(agent, None)
+        self._changed()
+        if isinstance(relation, (PartitionRelation, PointedRelation)):
+            relation.filter(func)
+        else:
+            self.relations[agent] = TrackedRelation(edge for edge in relation if func(edge))
 
     def get_power_set_of_worlds(self):
         """Returns a list with all possible sub sets of world names, sorted
@@ -71,13 +321,11 @@ class KripkeStructure:
 
     def nodes_not_follow_formula(self, formula):
         """Returns a list with all worlds of Kripke structure, where formula
-         is not satisfiable
+         is not satisfiable. The formula is evaluated once for all worlds,
+         see the extension() of the formula classes.
         """
-        nodes_not_follow_formula = []
-        for nodes in self.worlds:
-            if not formula.semantic(self, nodes.name):
-                nodes_not_follow_formula.append(nodes.name)
-        return nodes_not_follow_formula
+        extension = formula.extension(self)
+        return [world.name for world in self.worlds if world.name not in extension]
 
     def __eq__(self, other):
         """Returns true iff two Kripke structures are equivalent
@@ -111,6 +359,290 @@ class KripkeStructure:
         return worlds_str + '}, R = ' + str(self.relations) + ')'
 
 
+class EvaluationCache:
+    """
+    Least recently used cache for the truth values of formulas in worlds.
+    Once it holds maxsize entries, adding one evicts the entry that was used
+    longest ago.
+    """
+
+    def __init__(self, maxsize=2 ** 16):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = self.entries.get(key, self)
+        if value is self:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Reachability:
+    """
+    Reachability over the union of all relations of a Kripke structure.
+    Every distinct successor set becomes one node of a graph, that connects
+    each world to its successor sets and each successor set to its worlds.
+    Worlds in the same class of an S5 relation share one successor set, so
+    this graph stays linear in the size of the relations. Its strongly
+    connected components are computed once and shared by all queries.
+    """
+
+    def __init__(self, ks, signature=None):
+        self.signature = signature
+        self.names = [world.name for world in ks.worlds]
+        self.index = {name: num for num, name in enumerate(self.names)}
+        self.adjacency = [[] for _ in self.names]
+        successor_nodes = {}
+        for agent in ks.agents():
+            for num, name in enumerate(self.names):
+                successors = ks.successors(name, agent)
+                if not successors:
+                    continue
+                if id(successors) not in successor_nodes:
+                    successor_nodes[id(successors)] = (successors, len(self.adjacency))
+                    self.adjacency.append([self.index[end_node] for end_node in successors
+                                           if end_node in self.index])
+                self.adjacency[num].append(successor_nodes[id(successors)][1])
+        self.components, self.component_of = self._strongly_connected_components()
+        self._closures = {}
+        self._bounded = {}
+
+    def _strongly_connected_components(self):
+        """Tarjan's algorithm without recursion. Components are returned in
+        reverse topological order, i.e. every component comes after all
+        components it can reach.
+        """
+        low = [0] * len(self.adjacency)
+        order = [None] * len(self.adjacency)
+        component_of = [None] * len(self.adjacency)
+        components = []
+        stack = []
+        counter = 0
+        for root in range(len(self.adjacency)):
+            if order[root] is not None:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, child_num = work.pop()
+                if child_num == 0:
+                    order[node] = low[node] = counter
+                    counter += 1
+                    stack.append(node)
+                recurse = False
+                children = self.adjacency[node]
+                while child_num < len(children):
+                    child = children[child_num]
+                    child_num += 1
+                    if order[child] is None:
+                        work.append((node, child_num))
+                        work.append((child, 0))
+                        recurse = True
+                        break
+                    if component_of[child] is None:
+                        low[node] = min(low[node], order[child])
+                if recurse:
+                    continue
+                if low[node] == order[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        component_of[member] = len(components)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+        return components, component_of
+
+    def _component_successors(self, component):
+        successors = set()
+        for member in self.components[component]:
+            for child in self.adjacency[member]:
+                if self.component_of[child] != component:
+                    successors.add(self.component_of[child])
+        return successors
+
+    def closure(self, component):
+        """Returns the indices of all worlds reachable from a component.
+        """
+        if component not in self._closures:
+            # Components reach only earlier components, so fill them in order.
+            for num in range(component + 1):
+                if num in self._closures:
+                    continue
+                worlds = {member for member in self.components[num] if member < len(self.names)}
+                for successor in self._component_successors(num):
+                    worlds |= self._closures[successor]
+                self._closures[num] = frozenset(worlds)
+        return self._closures[component]
+
+    def reachable(self, world, depth=None):
+        if world not in self.index:
+            return frozenset()
+        if depth is None:
+            return frozenset(self.names[num] for num in self.closure(self.component_of[self.index[world]]))
+        if (world, depth) not in self._bounded:
+            reached = {self.index[world]}
+            frontier = [self.index[world]]
+            expanded = set()
+            for _ in range(depth):
+                next_frontier = []
+                for num in frontier:
+                    for successor_node in self.adjacency[num]:
+                        if successor_node in expanded:
+                            continue
+                        expanded.add(successor_node)
+                        for end_node in self.adjacency[successor_node]:
+                            if end_node not in reached:
+                                reached.add(end_node)
+                                next_frontier.append(end_node)
+                frontier = next_frontier
+            self._bounded[(world, depth)] = frozenset(self.names[num] for num in reached)
+        return self._bounded[(world, depth)]
+
+    def closed_extension(self, extension):
+        """Returns the set of names of the worlds, from which only worlds in
+        extension are reachable.
+        """
+        closed = []
+        for num, component in enumerate(self.components):
+            closed.append(all(self.names[member] in extension for member in component if member < len(self.names))
+                          and all(closed[successor] for successor in self._component_successors(num)))
+        return frozenset(name for num, name in enumerate(self.names) if closed[self.component_of[num]])
+
+
+def fork_relations(relations):
+    """Returns a copy of the relations like copy_relations, where partition
+    and pointed relations share their successor sets with the original ones
+    until they are changed.
+    """
+    if isinstance(relations, dict):
+        return {agent: fork_relations(value) for agent, value in relations.items()}
+    if isinstance(relations, (PartitionRelation, PointedRelation)):
+        return relations.fork()
+    return relations.copy()
+
+
+def copy_relations(relations):
+    """Returns a copy of the relations, that can be changed without changing
+    the original ones.
+    """
+    if isinstance(relations, dict):
+        return {agent: value.copy() for agent, value in relations.items()}
+    return relations.copy()
+
+
+class RelationMap(dict):
+    """
+    The relations of a Kripke structure by agent. The structure is told when
+    a relation is replaced or removed, and relations that are put in are
+    tracked by it, see KripkeStructure.relations.
+    """
+
+    def __init__(self, ks, relations):
+        super().__init__()
+        self._ks = ks
+        for agent, relation in relations.items():
+            dict.__setitem__(self, agent, ks._track(agent, relation))
+
+    def __setitem__(self, agent, relation):
+        self._release(agent)
+        dict.__setitem__(self, agent, self._ks._track(agent, relation))
+        self._ks._relation_changed(agent)
+
+    def __delitem__(self, agent):
+        self._release(agent)
+        dict.__delitem__(self, agent)
+        self._ks._relation_changed(agent)
+
+    def _release(self, agent):
+        # A relation that is taken out no longer reports to the structure
+        relation = self.get(agent)
+        if relation is not None:
+            relation._on_change = None
+
+    def pop(self, agent, *default):
+        if agent not in self:
+            return dict.pop(self, agent, *default)
+        relation = self[agent]
+        del self[agent]
+        return relation
+
+    def popitem(self):
+        if not self:
+            raise KeyError('popitem(): dictionary is empty')
+        agent = next(reversed(self))
+        return agent, self.pop(agent)
+
+    def clear(self):
+        for agent in list(self):
+            del self[agent]
+
+    def update(self, *args, **kwargs):
+        for agent, relation in dict(*args, **kwargs).items():
+            self[agent] = relation
+
+    def setdefault(self, agent, default=None):
+        if agent not in self:
+            self[agent] = default
+        return self[agent]
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class TrackedRelation(set):
+    """
+    Relation of a Kripke structure as set of (start, end) tuples, that calls
+    _on_change whenever it is changed in place.
+    """
+
+    _on_change = None
+
+    def __reduce__(self):
+        return set, (set(self),)
+
+
+def _reporting_change(method):
+    def changing(self, *args):
+        result = method(self, *args)
+        if self._on_change is not None:
+            self._on_change()
+        return result
+    changing.__name__ = method.__name__
+    changing.__doc__ = method.__doc__
+    return changing
+
+
+for _name in ('add', 'discard', 'remove', 'pop', 'clear', 'update', 'difference_update', 'intersection_update',
+              'symmetric_difference_update', '__ior__', '__iand__', '__isub__', '__ixor__'):
+    setattr(TrackedRelation, _name, _reporting_change(getattr(set, _name)))
+
+
 class World:
     """
     Represents the nodes of Kripke and it extends the graph to Kripke
@@ -126,3 +658,274 @@ class World:
 
     def __str__(self):
         return "(" + self.name + ',' + str(self.assignment) + ')'
+
+
+
+class PartitionRelation:
+    """
+    Accessibility relation of one agent, that stores for each world the set
+    of worlds it can reach instead of every pair of worlds. Worlds in the
+    same equivalence class share one successor set, so an S5 relation needs
+    memory linear in the number of worlds. Restricting and refining keep
+    this sharing, while iteration still yields (start, end) tuples.
+    """
+
+    def __init__(self, successors=None):
+        self.successors_by_world = {} if successors is None else successors
+        # Whether successors_by_world is shared with a fork
+        self._shared = False
+        # Called after every change, see KripkeStructure.relations
+        self._on_change = None
+
+    @classmethod
+    def from_key(cls, world_names, key):
+        """Returns the equivalence relation, where two worlds are related iff
+        they have the same key.
+        """
+        classes = {}
+        for name in world_names:
+            classes.setdefault(key(name), []).append(name)
+        successors = {}
+        for members in classes.values():
+            block = frozenset(members)
+            for name in members:
+                successors[name] = block
+        return cls(successors)
+
+    def successors(self, world):
+        """Returns the set of worlds that world can reach.
+        """
+        return self.successors_by_world.get(world, frozenset())
+
+    def restrict(self, predicate):
+        """Removes all edges, whose end node does not satisfy predicate.
+        """
+        self._map_blocks(lambda block: frozenset(name for name in block if predicate(name)))
+        self._changed()
+
+    def refine(self, key):
+        """Removes all edges between worlds with different keys.
+        """
+        split_blocks = {}
+        refined = {}
+        for world, block in self.successors_by_world.items():
+            parts = split_blocks.get(id(block))
+            if parts is None:
+                parts = {}
+                for name in block:
+                    parts.setdefault(key(name), []).append(name)
+                parts = {part_key: frozenset(names) for part_key, names in parts.items()}
+                split_blocks[id(block)] = parts
+            part = parts.get(key(world))
+            if part:
+                refined[world] = part
+        self.successors_by_world = refined
+        self._changed()
+
+    def filter(self, func):
+        """Removes all edges, for which func returns false. Successor sets,
+        that end up equal, are shared again.
+        """
+        shared = {}
+        filtered = {}
+        for world, block in self.successors_by_world.items():
+            successors = frozenset(name for name in block if func((world, name)))
+            if successors:
+                filtered[world] = shared.setdefault(successors, successors)
+        self.successors_by_world = filtered
+        self._changed()
+
+    def remove_world(self, node_name):
+        """Removes all edges, that start or end in the given world.
+        """
+        self.remove_worlds({node_name})
+
+    def remove_worlds(self, node_names):
+        """Removes all edges, that start or end in one of the given worlds.
+        """
+        self._own()
+        for node_name in node_names:
+            self.successors_by_world.pop(node_name, None)
+        self._map_blocks(lambda block: block.difference(node_names) if not block.isdisjoint(node_names) else block)
+        self._changed()
+
+    def _map_blocks(self, func):
+        mapped_blocks = {}
+        mapped = {}
+        for world, block in self.successors_by_world.items():
+            if id(block) not in mapped_blocks:
+                mapped_blocks[id(block)] = func(block)
+            if mapped_blocks[id(block)]:
+                mapped[world] = mapped_blocks[id(block)]
+        self.successors_by_world = mapped
+
+    def add(self, edge):
+        start_node, end_node = edge
+        self._own()
+        self.successors_by_world[start_node] = self.successors(start_node) | {end_node}
+        self._changed()
+
+    def remove(self, edge):
+        start_node, end_node = edge
+        successors = self.successors(start_node)
+        if end_node not in successors:
+            raise KeyError(edge)
+        self._own()
+        if len(successors) == 1:
+            del self.successors_by_world[start_node]
+        else:
+            self.successors_by_world[start_node] = successors - {end_node}
+        self._changed()
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_on_change'] = None
+        return state
+
+    def _own(self):
+        # Changing successors_by_world in place needs a dict that is not shared
+        if self._shared:
+            self.successors_by_world = self.successors_by_world.copy()
+            self._shared = False
+
+    def copy(self):
+        return PartitionRelation(self.successors_by_world.copy())
+
+    def fork(self):
+        """Returns a copy of the relation, that shares the successor sets
+        with this one until either relation is changed.
+        """
+        forked = PartitionRelation(self.successors_by_world)
+        self._shared = forked._shared = True
+        return forked
+
+    def __iter__(self):
+        for start_node, successors in self.successors_by_world.items():
+            for end_node in successors:
+                yield start_node, end_node
+
+    def __len__(self):
+        return sum(len(successors) for successors in self.successors_by_world.values())
+
+    def __contains__(self, edge):
+        start_node, end_node = edge
+        return end_node in self.successors(start_node)
+
+    def __eq__(self, other):
+        if isinstance(other, PartitionRelation):
+            return self.successors_by_world == other.successors_by_world
+        return len(self) == len(other) and all(edge in self for edge in other)
+
+    __hash__ = None
+
+    def __str__(self):
+        return str(set(self))
+
+
+class PointedRelation:
+    """
+    Accessibility relation of one agent in a pointed model, that only stores
+    the successor set of the actual world. The successors of any other world
+    are computed when they are asked for, from its successors in the initial
+    relation and every restriction, refinement and filter applied since, so
+    these have to keep giving the same answers. Iteration only yields the
+    edges of the actual world.
+    """
+
+    def __init__(self, point, successors, candidates):
+        self.point = point
+        self.point_successors = frozenset(successors)
+        # Returns the successors of a world in the initial relation
+        self.candidates = candidates
+        # Every edge of the relation passes all tests. Tests are only added,
+        # so the tuple and the cached successor sets can be shared by forks.
+        self.tests = ()
+        self._successors_by_world = {}
+        # Called after every change, see KripkeStructure.relations
+        self._on_change = None
+
+    def successors(self, world):
+        """Returns the set of worlds that world can reach.
+        """
+        if world == self.point:
+            return self.point_successors
+        successors = self._successors_by_world.get(world)
+        if successors is None:
+            successors = frozenset(name for name in self.candidates(world)
+                                   if all(test((world, name)) for test in self.tests))
+            self._successors_by_world[world] = successors
+        return successors
+
+    def restrict(self, predicate):
+        """Removes all edges, whose end node does not satisfy predicate.
+        """
+        self.point_successors = frozenset(name for name in self.point_successors if predicate(name))
+        self._add_test(lambda edge: predicate(edge[1]))
+
+    def refine(self, key):
+        """Removes all edges between worlds with different keys.
+        """
+        point_key = key(self.point)
+        self.point_successors = frozenset(name for name in self.point_successors if key(name) == point_key)
+        self._add_test(lambda edge: key(edge[0]) == key(edge[1]))
+
+    def filter(self, func):
+        """Removes all edges, for which func returns false.
+        """
+        self.point_successors = frozenset(name for name in self.point_successors if func((self.point, name)))
+        self._add_test(func)
+
+    def remove_world(self, node_name):
+        """Removes all edges, that start or end in the given world.
+        """
+        self.remove_worlds({node_name})
+
+    def remove_worlds(self, node_names):
+        """Removes all edges, that start or end in one of the given worlds.
+        """
+        node_names = frozenset(node_names)
+        if self.point in node_names:
+            self.point_successors = frozenset()
+        else:
+            self.point_successors = self.point_successors.difference(node_names)
+        self._add_test(lambda edge: edge[0] not in node_names and edge[1] not in node_names)
+
+    def _add_test(self, test):
+        self.tests = self.tests + (test,)
+        self._successors_by_world = {}
+        if self._on_change is not None:
+            self._on_change()
+
+    def fork(self):
+        """Returns a copy of the relation, that can be changed without
+        changing this one.
+        """
+        forked = copy.copy(self)
+        forked._on_change = None
+        return forked
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_on_change'] = None
+        return state
+
+    def __iter__(self):
+        for end_node in self.point_successors:
+            yield self.point, end_node
+
+    def __len__(self):
+        return len(self.point_successors)
+
+    def __contains__(self, edge):
+        start_node, end_node = edge
+        return end_node in self.successors(start_node)
+
+    __hash__ = None
+
+    def __str__(self):
+        return str(set(self))
+
@@ -1,6 +1,10 @@
-from mlsolver.kripke import KripkeStructure, World
+from mlsolver.kripke import KripkeStructure, PartitionRelation, PointedRelation, World
 from mlsolver.formula import Atom, And, Not, Or, Box_a, Box_star
 import copy
+from itertools import combinations, product
+from math import factorial
+
+import numpy as np
         
 
 class Mafia:
@@ -23,27 +27,17 @@ class Mafia:
         
     
     def generate_relations(self, worlds):
+        # Player num cannot distinguish the worlds in which they have the same role,
+        # so their relation is the partition of the worlds by the role of player num.
+        names = [world.name for world in worlds]
         relations = {}
-        for itr in range(len(worlds[0].assignment.keys())):
-            relations[str(itr)] = set(())
-        for world in worlds:
-            for num, key in enumerate(world.assignment.keys()):
-                for world2 in worlds:
-                    if key in world2.assignment:
-                        relations[str(num)].add((world.name, world2.name))
+        for num in range(len(worlds[0].assignment.keys())):
+            relations[str(num)] = PartitionRelation.from_key(names, lambda name, num=num: name[num])
         return relations
     
         
     def generate_worlds(self, roles):
-        worldLists = []
-        worldSize = sum(roles.values())
-        for role in roles:
-            worldLists.append(self.add_players(role, roles[role], worldSize))
-            worldSize -= roles[role]
-        tempWorlds = []
-        # Combine the worlds from add_players with only 1 player into actual worlds.
-        modelWorlds = self.combine_worlds(worldLists)
-        worlds = self.convert_worlds(modelWorlds)
+        worlds = [self.convert_world(world) for world in generate_role_assignments(roles)]
         print(f"Actually, there were {len(worlds)} worlds.")
         return worlds
         
@@ -63,77 +57,288 @@ class Mafia:
         for world in worlds:
             converted.append(self.convert_world(world))
         return converted
-        
-    
-    def combine_worlds(self, worldLists):
-        itrs = [0 for worldList in worldLists]
-        ret = []
-        while True:
-            # Combine worlds as listed in itrs.
-            worlds = [copy.deepcopy(worldLists[num][itr]) for num, itr in enumerate(itrs)]
-            tempWorld = worlds[0]
-            for itr in range(len(tempWorld)): 
-                if tempWorld[itr] is None:
-                    roleAdded = False
-                    for witr in range(1, len(worlds)):
-                        if worlds[witr]:
-                            role = worlds[witr][0]
-                            worlds[witr].pop(0)
-                            if role is not None:
-                                tempWorld[itr] = role
-                                roleAdded = True
-                                break
-                    if not roleAdded:
-                        # If this is ever printed, there is a bug in the code!
-                        print("Role could not be added!")
-            ret.append(tempWorld)
-            # Go to the next world.
-            worldsLeft = False
-            for count in range(len(worldLists)):
-                itrs[count] += 1
-                if itrs[count] == len(worldLists[count]):
-                    itrs[count] = 0
-                    continue
-                worldsLeft = True
-                break
-            if not worldsLeft:
-                break
-            
-        return ret
-    
-    def add_players(self, role, numPlayers, worldSize):
-        print(f"Adding {numPlayers} {role}.")
-        # The places where players with this role are added.
-        places = [itr for itr in range(numPlayers)]
-        # The "worlds" with only players with this role added.
-        worlds = []
-        while(True):
-            # Add a world with the initial positions of the roles.
-            world = [None for itr in range(worldSize)]
-            for place in places:
-                world[place] = role
-            worlds.append(world)
-            # Get positions where the players with this role should be added next.
-            added = False
-            for itr in range(1, numPlayers + 1):
-                places[-itr] += 1
-                if places[-itr] == worldSize:
-                    continue
-                additional = 1
-                mustContinue = False
-                for itr2 in range(itr - 1, 0, -1):
-                    places[-itr2] = places[-itr] + additional
-                    if places[-itr2] == worldSize:
-                        mustContinue = True
-                    additional += 1
-                if mustContinue:
-                    continue
-                added = True
-                break
-            # If all position have been searched, we are done here.
-            if not added:
-                break
-        return worlds
+
+
+class PointedMafia:
+    """
+    Class models a game of Mafia by a pointed Kripke model. For each agent it
+    only keeps the worlds, that the agent considers possible in the actual
+    world, which is all that players read during a game. Relations of other
+    worlds, e.g. for formulas with nested knowledge of different agents, are
+    computed when they are needed, which takes time in the number of all
+    worlds for each world asked for. Evaluating a formula on the whole model
+    at once, common knowledge and solve() are not supported.
+    """
+
+    def __init__(self, roles, actual_world):
+        self.roles = roles
+        self.letters = {role[0].upper(): role for role in roles}
+        relations = {}
+        others_by_letter = {}
+        for num, letter in enumerate(actual_world):
+            if letter not in others_by_letter:
+                others_by_letter[letter] = self.names_without(letter)
+            relations[str(num)] = PointedRelation(actual_world, self.worlds_with(num, letter, others_by_letter[letter]),
+                                                  lambda world, num=num: self.worlds_with(num, world[num]))
+        self.ks = PointedKripkeStructure([world_from_name(actual_world)], relations)
+        print(f"The pointed Kripke model keeps {sum(len(relation) for relation in relations.values())} "
+              f"edges of the actual world.")
+
+    def worlds_with(self, player, letter, others=None):
+        """Yields the names of all worlds, where player has the role with the
+        given letter, from the names of the other players in these worlds.
+        """
+        if others is None:
+            others = self.names_without(letter)
+        for name in others:
+            yield name[:player] + letter + name[player:]
+
+    def names_without(self, letter):
+        """Returns the names of all worlds of one player less, who has the
+        role with the given letter.
+        """
+        return generate_world_names({role[0].upper(): count - (role[0].upper() == letter)
+                                     for role, count in self.roles.items()})
+
+
+class PointedKripkeStructure(KripkeStructure):
+    """
+    Kripke structure of a PointedMafia, whose worlds are created from their
+    names when a formula is evaluated in them.
+    """
+
+    # Names of the worlds that were removed, which are not created any more
+    removed = frozenset()
+
+    def get_world(self, name):
+        """Returns the world with the given name, or None if it was removed.
+        """
+        world = super().get_world(name)
+        if world is None and name not in self.removed:
+            world = world_from_name(name)
+        return world
+
+    def remove_node_by_name(self, node_name):
+        self.remove_nodes_by_name({node_name})
+
+    def remove_nodes_by_name(self, node_names):
+        node_names = set(node_names)
+        self.removed = self.removed | node_names
+        super().remove_nodes_by_name(node_names)
+
+
+def world_from_name(name):
+    """Returns the world with the given name, whose letters are the roles of
+    the players, e.g. 'MVV'.
+    """
+    return World(name, {f'{num}:{letter}': True for num, letter in enumerate(name)})
+
+
+class CountingMafia:
+    """
+    Class models a game of Mafia by the counting abstraction. Players with the
+    same role are interchangeable, so the worlds an agent considers possible
+    are all assignments of the roles, where each player has one of the roles
+    the agent still allows for that player. These sets of roles per player
+    and the number of players per role are all that is stored, so memory only
+    grows with the square of the number of players.
+    """
+
+    def __init__(self, roles, actual_world):
+        self.ks = CountingStructure([role[0].upper() for role in roles], list(roles.values()), actual_world)
+        world_count = factorial(len(actual_world))
+        for count in roles.values():
+            world_count //= factorial(count)
+        print(f"The counting abstraction stands for {world_count} worlds.")
+
+
+class CountingStructure:
+    """
+    The knowledge of the agents in the counting abstraction. For each agent a
+    boolean matrix holds whether each player may have each role. Only
+    relations of the actual world are kept, and they can only be changed by
+    RoleConstraint, RolePositions and Conjunction of these, which is all
+    that players use in a game.
+    """
+
+    def __init__(self, letters, counts, actual_world):
+        self.letters = letters
+        self.counts = np.array(counts, dtype=np.int64)
+        self.actual_world = actual_world
+        self.domains = {}
+        for num, letter in enumerate(actual_world):
+            # Every player knows their own role
+            domains = np.ones((len(actual_world), len(letters)), dtype=bool)
+            domains[num] = self.letter_mask(letter)
+            self.domains[str(num)] = domains
+        # The rows of all subsets of the roles
+        self.role_subsets = np.array([[subset >> num & 1 for num in range(len(letters))]
+                                      for subset in range(2 ** len(letters))], dtype=bool)
+
+    def letter_mask(self, letter):
+        return np.array([other == letter for other in self.letters])
+
+    def fork(self):
+        """Returns a copy of the structure, that can be changed without
+        changing this one. The domains of each agent are shared until they
+        change.
+        """
+        forked = copy.copy(self)
+        forked.domains = dict(self.domains)
+        return forked
+
+    def restrict_relation(self, agent, predicate):
+        """Keeps only the worlds of agent, that satisfy predicate.
+        """
+        if isinstance(predicate, Conjunction):
+            for member in predicate.predicates:
+                self.restrict_relation(agent, member)
+        elif isinstance(predicate, RoleConstraint):
+            mask = self.letter_mask(predicate.letter)
+            # Domains are replaced instead of changed, as forks may share them
+            domains = self.domains[agent].copy()
+            domains[predicate.player] &= mask if predicate.has else ~mask
+            self.domains[agent] = domains
+        else:
+            raise NotImplementedError("The counting abstraction can only be restricted by role constraints")
+
+    def refine_relation(self, agent, key):
+        """Keeps only the worlds of agent with the same key as the actual world.
+        """
+        if not isinstance(key, RolePositions):
+            raise NotImplementedError("The counting abstraction can only be refined by role positions")
+        mask = self.letter_mask(key.letter)
+        domains = self.domains[agent].copy()
+        for num, letter in enumerate(self.actual_world):
+            domains[num] &= mask if letter == key.letter else ~mask
+        self.domains[agent] = domains
+
+    def filter_relation(self, agent, func):
+        raise NotImplementedError("The counting abstraction can only be restricted by role constraints")
+
+    def successors(self, world, agent=None):
+        raise NotImplementedError("The counting abstraction does not enumerate worlds")
+
+    def possible_roles(self, agent, letters=None):
+        """Returns the boolean matrix, whether agent considers a world possible,
+        where the player of the row has the role of the column. The columns are
+        the given letters, or the letters of the roles.
+        """
+        domains = self.domains[agent]
+        # By Hall's theorem the roles can be assigned iff for every set of roles
+        # the players, who may only have one of these roles, are not more than
+        # the players with these roles. Player p gets role r iff that still holds
+        # without p and one player with role r.
+        inside = ~(domains[np.newaxis, :, :] & ~self.role_subsets[:, np.newaxis, :]).any(axis=2)
+        players = inside.sum(axis=1)
+        capacity = self.role_subsets @ self.counts
+        fits = (players[:, np.newaxis, np.newaxis] - inside[:, :, np.newaxis]
+                <= capacity[:, np.newaxis, np.newaxis] - self.role_subsets[:, np.newaxis, :]).all(axis=0)
+        possible = domains & fits & (self.counts > 0)
+        if letters is None:
+            return possible
+        columns = [possible[:, self.letters.index(letter)] if letter in self.letters
+                   else np.zeros(len(domains), dtype=bool) for letter in letters]
+        return np.stack(columns, axis=1)
+
+    def knows(self, agent, formula):
+        """Returns whether agent knows formula, which may consist of atoms
+        like "0:M", their negations and conjunctions.
+        """
+        if isinstance(formula, And):
+            return self.knows(agent, formula.left) and self.knows(agent, formula.right)
+        possible = self.possible_roles(agent)
+        if not possible.any():
+            # Without any possible world everything is known
+            return True
+        if isinstance(formula, Atom):
+            player, letter = formula.name.split(':')
+            return possible[int(player)].sum() == 1 and letter in self.letters \
+                and possible[int(player), self.letters.index(letter)]
+        if isinstance(formula, Not) and isinstance(formula.inner, Atom):
+            player, letter = formula.inner.name.split(':')
+            return letter not in self.letters or not possible[int(player), self.letters.index(letter)]
+        raise NotImplementedError("The counting abstraction only decides knowledge of roles")
+
+
+class RoleConstraint:
+    """
+    Predicate on world names, that holds iff player has the role with the
+    given letter, or does not have it if has is False.
+    """
+
+    def __init__(self, player, letter, has=True):
+        self.player = player
+        self.letter = letter
+        self.has = has
+
+    def __call__(self, world):
+        return (world[self.player] == self.letter) == self.has
+
+
+class RolePositions:
+    """
+    Key of world names, that are the players with the role of the given letter.
+    """
+
+    def __init__(self, letter):
+        self.letter = letter
+
+    def __call__(self, world):
+        return tuple(location for location, role in enumerate(world) if role == self.letter)
+
+
+class Conjunction:
+    """
+    Predicate on world names, that holds iff all predicates hold. Results are
+    remembered per world, so it can be shared by the relations of many agents.
+    """
+
+    def __init__(self, predicates):
+        self.predicates = tuple(predicates)
+        self.holds = {}
+
+    def __call__(self, world):
+        if world not in self.holds:
+            self.holds[world] = all(predicate(world) for predicate in self.predicates)
+        return self.holds[world]
+
+
+def generate_world_names(letter_counts):
+    """Returns the names of all worlds with the given number of players per
+    role letter, e.g. {"M": 1, "V": 2} gives ["MVV", "VMV", "VVM"].
+    """
+    letters = list(letter_counts)
+    names = [("", tuple(letter_counts.values()))]
+    for _ in range(sum(letter_counts.values())):
+        names = [(name + letter, counts[:num] + (counts[num] - 1,) + counts[num + 1:])
+                 for name, counts in names for num, letter in enumerate(letters) if counts[num]]
+    return [name for name, _ in names]
+
+
+def generate_role_assignments(roles):
+    """Yields every distinct assignment of the given roles to the players as
+    a tuple with one role per player, i.e. the permutations of the multiset
+    of roles. Players of the first role are placed first among all seats,
+    players of the next role among the seats that are left, and so on; the
+    placement of the first role changes fastest.
+    """
+    seat_choices = []
+    seats_left = sum(roles.values())
+    for role, count in roles.items():
+        seat_choices.append((role, list(combinations(range(seats_left), count))))
+        seats_left -= count
+    player_count = sum(roles.values())
+    # product() varies its last argument fastest, so feed the roles reversed.
+    for choice in product(*[choices for _, choices in reversed(seat_choices)]):
+        world = [None] * player_count
+        free = list(range(player_count))
+        for (role, _), seats in zip(seat_choices, reversed(choice)):
+            for seat in seats:
+                world[free[seat]] = role
+            taken = set(seats)
+            free = [place for num, place in enumerate(free) if num not in taken]
+        yield tuple(world)
 
 
 def add_symmetric_edges(relations):
@@ -1,8 +1,15 @@
 """Modal logic tableau module
 
 This module contains data structures, that describe the proof tree of
-modal logic formula and the rules of the tableau calculus.
+modal logic formula and the rules of the tableau calculus, and a batch
+routine that derives many formulas in a pool of processes.
 """
+import os
+import time
+from bisect import bisect_left, insort
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
 from mlsolver.formula import *
 from mlsolver.kripke import *
 
@@ -16,49 +23,55 @@ class ProofTree:
     flow, that checks if the tree has not derived nodes, expands these
     nodes, adds their children to the leafs and checks whether a path
     is closed.
+
+    Box and Diamond as well as Box_a and Diamond_a of any number of agents
+    are interpreted in the logic K, or in S5 if logic is 'S5'. New worlds
+    are named s, t, w2, w3 and so on.
     """
 
-    def __init__(self, formula):
-        self.WORLDS = ['t', 's']
-        self.start_world = self.WORLDS.pop()
+    def __init__(self, formula, logic='K'):
+        if logic not in ('K', 'S5'):
+            raise ValueError(f"Unknown logic {logic}, use 'K' or 'S5'")
+        self.logic = logic
+        self.agents = modal_agents(formula)
+        self.world_names = fresh_world_names()
+        self.start_world = next(self.world_names)
         self.root_node = self.create_node(self.start_world, formula, [])
         self.root_node.partial_assign = {self.start_world: {}}
         self.kripke_structure = None
         self.is_closed = None
 
-    def derive(self):
+    def derive(self, timeout=None):
         """Determines a valid Kripke structure if formula is satisfiable.
+        The nodes, that are not derived yet, are kept on a stack in pre-order
+        sequence and the open leafs are kept sorted by their position in the
+        tree, so the tree is never walked again from the root. Conflicts are
+        checked whenever nodes are added, so closed branches are never
+        expanded and derive stops as soon as all branches are closed.
+        Raises TimeoutError if derive takes longer than timeout seconds.
         """
-        next_node = self.root_node.__next__()
-
-        while next_node is not None:
-            leafs = next_node.get_all_leafs()
-            for leaf in leafs:
-                leaf.add_child(self.expand_node(next_node))
-            next_node.is_derived = True
-            next_node = self.root_node.__next__()
-        check_conflict(self.root_node)
-
-        """
-        Find leaf, that has no children and return its partial assignment
-        and relations as Kripke structure. The property solutions_leaf stores 
-        all leafs of the fully derived proof tree, to check whether formula is 
-        satisfiable.
-        """
-        solutions_leafs = self.root_node.get_all_leafs()
-        if solutions_leafs == []:
-            pass
-        else:
-            for leaf in solutions_leafs:
-                if not isinstance(leaf, Bottom):
-                    worlds = []
-                    for world_name, assign in leaf.partial_assign.items():
-                        world = World(world_name, assign)
-                        worlds.append(world)
-
-                    self.kripke_structure = KripkeStructure(worlds, leaf.relations)
-                    return
-            self.is_closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        inherit_assignment(self.root_node, {self.start_world: {}})
+        self.open_leafs = OpenLeafs()
+        self.open_leafs.add_subtree(self.root_node)
+        underived = [self.root_node]
+
+        while underived and self.open_leafs:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Derivation took longer than {timeout} seconds")
+            next_node = underived.pop()
+            if not next_node.is_derived:
+                for leaf in self.open_leafs.below(next_node):
+                    self.open_leafs.extend(leaf, self.expand_node(next_node, leaf))
+                next_node.is_derived = True
+            if isinstance(next_node.children, list):
+                underived.extend(reversed(next_node.children))
+
+        self.is_closed = not self.open_leafs
+        if not self.is_closed:
+            # The first open leaf holds the partial assignment and relations
+            # of a model
+            self.kripke_structure = self.kripke_structure_of(self.open_leafs.first())
 
     def create_node(self, world_name, formula, children):
         """Routine decides whether a node must be a leaf node, when it is not
@@ -72,21 +85,87 @@ class ProofTree:
             return Node(world_name, formula, children)
         return None
 
-    def resolve_box_operator(self, node, new_world):
-        """Walks through all parent nodes and check whether box operator
-        forces formula in new world
+    def kripke_structure_of(self, leaf):
+        """Returns the Kripke structure of the worlds and relations on the
+        branch, that ends in leaf.
         """
-        leafs = []
-        if node.parent is None:
-            return leafs
-        if isinstance(node.formula, Box):
-            leaf = self.create_node(new_world, node.formula.inner, [])
-            leaf.relations.add((node.world, new_world))
-            leafs.append(leaf)
-        return leafs + self.resolve_box_operator(node.parent, new_world)
-
-    def expand_node(self, node):
-        """Contains all rules of tableau calculus and tries to match them to a node
+        names = list(leaf.partial_assign)
+        for edge in sorted(leaf.relations, key=str):
+            names.extend(name for name in edge[:2] if name not in names)
+        if self.start_world not in names:
+            names.insert(0, self.start_world)
+        worlds = [World(name, dict(leaf.partial_assign.get(name, {}))) for name in names]
+
+        relations = {agent: set() for agent in self.agents}
+        for edge in leaf.relations:
+            relations.setdefault(edge_agent(edge), set()).add(edge[:2])
+        if self.logic == 'S5':
+            relations = {agent: equivalence_closure(names, edges) for agent, edges in relations.items()}
+        if set(relations) - {None}:
+            return KripkeStructure(worlds, relations)
+        return KripkeStructure(worlds, relations.get(None, set()))
+
+    def accessible(self, leaf, world, agent):
+        """Returns the worlds, that agent can reach from world on the branch,
+        that ends in leaf. In S5 these are all worlds of its equivalence class.
+        """
+        if self.logic == 'K':
+            return {edge[1] for edge in leaf.relations
+                    if edge[0] == world and edge_agent(edge) == agent}
+        neighbours = {}
+        for edge in leaf.relations:
+            if edge_agent(edge) == agent:
+                neighbours.setdefault(edge[0], []).append(edge[1])
+                neighbours.setdefault(edge[1], []).append(edge[0])
+        worlds = {world}
+        stack = [world]
+        while stack:
+            for neighbour in neighbours.get(stack.pop(), []):
+                if neighbour not in worlds:
+                    worlds.add(neighbour)
+                    stack.append(neighbour)
+        return worlds
+
+    def resolve_box_operator(self, leaf, worlds, agent):
+        """Walks through the branch, that ends in leaf, and returns the formulas,
+        that box operators of agent in one of the worlds force in a new world.
+        """
+        formulas = []
+        for node in branch(leaf):
+            modality = modal_operator(node.formula)
+            if modality is not None and modality[0] and modality[1] == agent and node.world in worlds:
+                formulas.append(modality[2])
+        return formulas
+
+    def expand_box(self, node, leaf, agent, inner):
+        """Forces inner in every world, that agent can reach from the world
+        of node on the branch, that ends in leaf, and that has no node with
+        inner yet.
+        """
+        worlds = self.accessible(leaf, node.world, agent)
+        worlds -= {other.world for other in branch(leaf) if node_formula(other) == inner}
+        return path_chain([self.create_node(world, inner, []) for world in sorted(worlds)])
+
+    def expand_diamond(self, node, leaf, agent, inner):
+        """Adds a new world reachable by agent, where inner and all formulas
+        forced by box operators hold. Nothing is added if a reachable world
+        on the branch already has inner, which also makes the tableau
+        terminate in S5.
+        """
+        worlds = self.accessible(leaf, node.world, agent)
+        if any(other.world in worlds and node_formula(other) == inner for other in branch(leaf)):
+            return None
+        if self.logic == 'K':
+            worlds = {node.world}
+        new_world = next(self.world_names)
+        formulas = dict.fromkeys([inner] + self.resolve_box_operator(leaf, worlds, agent))
+        nodes = [self.create_node(new_world, formula, []) for formula in formulas]
+        nodes[0].relations.add(make_edge(node.world, new_world, agent))
+        return path_chain(nodes)
+
+    def expand_node(self, node, leaf=None):
+        """Contains all rules of tableau calculus and tries to match them to a node.
+        The rules of modal operators depend on the branch, that ends in leaf.
         """
         if isinstance(node.formula, Atom):
             return None
@@ -109,6 +188,10 @@ class ProofTree:
                 return self.create_node(node.world, Diamond(Not(formula.inner)), [])
             if isinstance(formula, Diamond):
                 return self.create_node(node.world, Box(Not(formula.inner)), [])
+            if isinstance(formula, Box_a):
+                return self.create_node(node.world, Diamond_a(formula.agent, Not(formula.inner)), [])
+            if isinstance(formula, Diamond_a):
+                return self.create_node(node.world, Box_a(formula.agent, Not(formula.inner)), [])
             return self.create_node(node.world, formula, [])
 
         if isinstance(node.formula, And):
@@ -127,12 +210,14 @@ class ProofTree:
             second_node = self.create_node(node.world, node.formula.right, [])
             return [first_node, second_node]
 
-        if isinstance(node.formula, Diamond):
-            next_world = self.WORLDS.pop()
-            leafs_forced_by_box = self.resolve_box_operator(node, next_world)
-            node_to_add = self.create_node(next_world, node.formula.inner, leafs_forced_by_box)
-            node_to_add.relations.add((node.world, next_world))
-            return node_to_add
+        modality = modal_operator(node.formula)
+        if modality is not None:
+            is_box, agent, inner = modality
+            if leaf is None:
+                leaf = node
+            if is_box:
+                return self.expand_box(node, leaf, agent, inner)
+            return self.expand_diamond(node, leaf, agent, inner)
 
         return None
 
@@ -141,24 +226,252 @@ class ProofTree:
                '\n' + "Kripke structure\n================\n" + str(self.kripke_structure)
 
 
+SatisfiabilityResult = namedtuple('SatisfiabilityResult',
+                                  ['formula', 'is_satisfiable', 'kripke_structure', 'timed_out'])
+
+
+def check_satisfiability(formulas, logic='K', timeout=None, processes=None, chunksize=32):
+    """Yields one SatisfiabilityResult per formula in the order of formulas,
+    as soon as it and all results before it are known. Formulas are derived
+    in chunks by a pool of processes, the number of CPUs by default, and
+    structurally equal formulas are derived only once. If deriving a formula
+    takes longer than timeout seconds, is_satisfiable is None and timed_out
+    is True.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    results = {}
+    if processes == 1:
+        for formula in formulas:
+            if formula not in results:
+                results[formula] = derive_satisfiability(formula, logic, timeout)
+            yield results[formula]
+        return
+
+    submitted = set()
+    unreported = deque()
+    chunk = []
+    running = deque()
+    with ProcessPoolExecutor(processes) as executor:
+        def collect(future):
+            for result in future.result():
+                results[result.formula] = result
+            while unreported and unreported[0] in results:
+                yield results[unreported.popleft()]
+
+        for formula in formulas:
+            unreported.append(formula)
+            if formula in submitted:
+                continue
+            submitted.add(formula)
+            chunk.append(formula)
+            if len(chunk) == chunksize:
+                running.append(executor.submit(derive_chunk, chunk, logic, timeout))
+                chunk = []
+                if len(running) > 2 * processes:
+                    yield from collect(running.popleft())
+        if chunk:
+            running.append(executor.submit(derive_chunk, chunk, logic, timeout))
+        while running:
+            yield from collect(running.popleft())
+
+
+def derive_satisfiability(formula, logic='K', timeout=None):
+    """Returns the SatisfiabilityResult of one formula.
+    """
+    tree = ProofTree(formula, logic)
+    try:
+        tree.derive(timeout)
+    except TimeoutError:
+        return SatisfiabilityResult(formula, None, None, True)
+    return SatisfiabilityResult(formula, not tree.is_closed, tree.kripke_structure, False)
+
+
+def derive_chunk(formulas, logic, timeout):
+    return [derive_satisfiability(formula, logic, timeout) for formula in formulas]
+
+
+def fresh_world_names():
+    """Yields the names of new worlds: s, t, w2, w3, ...
+    """
+    yield 's'
+    yield 't'
+    num = 2
+    while True:
+        yield f'w{num}'
+        num += 1
+
+
+def modal_operator(formula):
+    """Returns (is_box, agent, inner) if formula is a Box, Diamond, Box_a or
+    Diamond_a, where agent is None for Box and Diamond, and None otherwise.
+    """
+    if isinstance(formula, Box):
+        return True, None, formula.inner
+    if isinstance(formula, Diamond):
+        return False, None, formula.inner
+    if isinstance(formula, Box_a):
+        return True, formula.agent, formula.inner
+    if isinstance(formula, Diamond_a):
+        return False, formula.agent, formula.inner
+    return None
+
+
+def modal_agents(formula):
+    """Returns the agents of all modal operators in formula, where None
+    stands for Box and Diamond.
+    """
+    agents = set()
+    formulas = [formula]
+    while formulas:
+        formula = formulas.pop()
+        modality = modal_operator(formula)
+        if modality is not None:
+            agents.add(modality[1])
+        formulas.extend(arg for arg in formula._args if isinstance(arg, Formula))
+    return agents
+
+
+def make_edge(start_world, end_world, agent):
+    """Returns an edge of the proof tree, which is a pair for Box and
+    Diamond and a triple with the agent for Box_a and Diamond_a.
+    """
+    if agent is None:
+        return start_world, end_world
+    return start_world, end_world, agent
+
+
+def edge_agent(edge):
+    return edge[2] if len(edge) == 3 else None
+
+
+def equivalence_closure(worlds, edges):
+    """Returns all pairs of worlds, that are connected by edges in either
+    direction, including all reflexive pairs.
+    """
+    classes = {world: {world} for world in worlds}
+    for (start_world, end_world) in edges:
+        if classes[start_world] is not classes[end_world]:
+            merged = classes[start_world] | classes[end_world]
+            for world in merged:
+                classes[world] = merged
+    return {(world, other) for world in worlds for other in classes[world]}
+
+
+def branch(leaf):
+    """Yields the nodes from leaf up to the root.
+    """
+    node = leaf
+    while node is not None:
+        yield node
+        node = node.parent
+
+
+def node_formula(node):
+    """Returns the formula of a node, which for a Leaf is its literal.
+    """
+    if isinstance(node, Leaf):
+        return Atom(node.variable_name) if node.assign else Not(Atom(node.variable_name))
+    return node.formula
+
+
+def path_chain(nodes):
+    """Makes each node the only child of the node before and returns the
+    first one, or None if there are no nodes.
+    """
+    for parent, child in zip(nodes, nodes[1:]):
+        parent.children.append(child)
+    return nodes[0] if nodes else None
+
+
 def check_conflict(node):
     """Routine walks through each node and checks whether leafs force
     conflict with partial assignment.
     """
+    nodes = [node] if inherit_assignment(node, node.partial_assign) else []
+    while nodes:
+        node = nodes.pop()
+        for child in node.children:
+            if inherit_assignment(child, node.partial_assign):
+                nodes.append(child)
+
+
+def inherit_assignment(node, partial_assign):
+    """Sets the partial assignment of node to the one of its parent, that
+    a Leaf extends by its literal. A Leaf, whose literal conflicts with it,
+    closes the branch and False is returned. Assignments are never changed
+    once set, so the assignments of worlds and whole assignments are shared
+    by all nodes with the same ones instead of being copied.
+    """
+    if not isinstance(node, Leaf):
+        node.partial_assign = partial_assign
+        return True
+    world_assign = partial_assign.get(node.world, {})
+    value = world_assign.get(node.variable_name)
+    if value is None:
+        node.partial_assign = dict(partial_assign)
+        node.partial_assign[node.world] = {**world_assign, node.variable_name: node.assign}
+        return True
+    node.partial_assign = partial_assign
+    if value is not node.assign:
+        node.children = Bottom()
+        return False
+    return True
+
+
+class OpenLeafs:
+    """
+    Keeps the leafs of a proof tree sorted by their path, i.e. the indices
+    of the children that lead from the root to them. This is the order of a
+    pre-order walk, and the leafs below a node are those, whose path starts
+    with the path of that node.
+    """
 
-    if isinstance(node, Leaf):
-        try:
-            if not node.partial_assign[node.world][node.variable_name] is node.assign:
-                node.children = Bottom()
-                return
-        except:
-            try:
-                node.partial_assign[node.world].update({node.variable_name: node.assign})
-            except:
-                node.partial_assign[node.world] = {node.variable_name: node.assign}
-    for child in node.children:
-        child.partial_assign.update(copy.deepcopy(node.partial_assign))
-        check_conflict(child)
+    def __init__(self):
+        self.paths = []
+        self.leafs = {}
+
+    def add_subtree(self, node):
+        """Assigns paths to node and all its descendants and adds the leafs
+        among them.
+        """
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            if node.children == []:
+                insort(self.paths, node.path)
+                self.leafs[node.path] = node
+            elif isinstance(node.children, list):
+                for num, child in enumerate(node.children):
+                    child.path = node.path + (num,)
+                    nodes.append(child)
+
+    def extend(self, leaf, nodes):
+        """Adds one node or a list of nodes as children to an open leaf.
+        """
+        leaf.add_child(nodes)
+        if leaf.children:
+            self.remove(leaf)
+            self.add_subtree(leaf)
+
+    def remove(self, leaf):
+        del self.paths[bisect_left(self.paths, leaf.path)]
+        del self.leafs[leaf.path]
+
+    def below(self, node):
+        """Returns the leafs below node in pre-order sequence.
+        """
+        start = bisect_left(self.paths, node.path)
+        end = bisect_left(self.paths, node.path + (float('inf'),))
+        return [self.leafs[path] for path in self.paths[start:end]]
+
+    def first(self):
+        """Returns the open leaf, that comes first in pre-order sequence.
+        """
+        return self.leafs[self.paths[0]]
+
+    def __len__(self):
+        return len(self.paths)
 
 
 class Node:
@@ -177,6 +490,7 @@ class Node:
         self.relations = set()
         self.parent = None
         self.level = 0
+        self.path = ()
 
     def add_child(self, nodes):
         """Routine adds one child node or list of children to the current
@@ -185,25 +499,37 @@ class Node:
         if isinstance(nodes, list):
             for node in nodes:
                 self.children.append(node)
-                node.parent = self
-                node.relations.update(self.relations)
         elif not nodes is None:
             # Just one node to add, not list
-            self.children.append(nodes)
-            nodes.parent = self
-            nodes.relations.update(self.relations)
+            nodes = [nodes]
+            self.children.extend(nodes)
+        else:
+            return
+        # Nodes built with children get their parent, the relations and the
+        # partial assignment of the branch as well. Both are shared with the
+        # parent unless the child adds to them.
+        edges = [(self, node) for node in nodes]
+        while edges:
+            parent, child = edges.pop()
+            child.parent = parent
+            if child.relations:
+                child.relations = parent.relations | child.relations
+            else:
+                child.relations = parent.relations
+            if inherit_assignment(child, parent.partial_assign):
+                edges.extend((child, grandchild) for grandchild in child.children)
 
     def get_all_leafs(self):
         """Returns a list of nodes, where each node has no children.
         """
         leafs = []
-
-        if self.children == []:
-            leafs.append(self)
-        elif not isinstance(self.children, Bottom):
-            for child in self.children:
-                for child_leafs in child.get_all_leafs():
-                    leafs.append(child_leafs)
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if node.children == []:
+                leafs.append(node)
+            elif not isinstance(node.children, Bottom):
+                nodes.extend(reversed(node.children))
         return leafs
 
     def __iter__(self):
@@ -212,16 +538,13 @@ class Node:
     def __next__(self):
         """Return next node, that is not derived yet in post order sequence.
         """
-        if self.is_derived is False:
-            return self
-        if isinstance(self.children, Bottom) or isinstance(self, Bottom):
-            return None
-        else:
-            for child in self.children:
-                if not child.is_derived:
-                    return child
-                if child.__next__() is not None:
-                    return child.__next__()
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if node.is_derived is False:
+                return node
+            if not isinstance(node.children, Bottom) and not isinstance(node, Bottom):
+                nodes.extend(reversed(node.children))
         return None
 
     def __eq__(self, other):
@@ -0,0 +1,106 @@
+import random
+
+import pytest
+
+from mlsolver.formula import And, Atom, Box_a, Box_star, Diamond_a, Implies, Not, Or, is_existential
+from mlsolver.kripke import KripkeStructure, World
+
+
+def test_replaced_relation_is_not_read_from_the_cache():
+    ks = KripkeStructure([World('a', {'p': True}), World('b', {})], {'1': {('a', 'a'), ('a', 'b')}})
+    formula = Box_a('1', Atom('p'))
+    assert not formula.semantic(ks, 'a')
+
+    ks.relations['1'] = {('a', 'a')}
+    assert ks.successors('a', '1') == {'a'}
+    assert formula.semantic(ks, 'a')
+
+    ks.relations = {'1': {('a', 'b')}}
+    assert not formula.semantic(ks, 'a')
+
+
+def test_relation_changed_in_place_is_not_read_from_the_cache():
+    ks = KripkeStructure([World('a', {'p': True}), World('b', {})], {'1': {('a', 'a'), ('a', 'b')}})
+    formula = Box_a('1', Atom('p'))
+    assert not formula.semantic(ks, 'a')
+
+    ks.relations['1'].discard(('a', 'b'))
+    assert ks.successors('a', '1') == {'a'}
+    assert formula.semantic(ks, 'a')
+
+    ks.relations['1'] |= {('a', 'b')}
+    assert ks.successors('a', '1') == {'a', 'b'}
+    assert not formula.semantic(ks, 'a')
+
+    # A fork has its own relations
+    forked = ks.fork()
+    forked.relations['1'].remove(('a', 'b'))
+    assert formula.semantic(forked, 'a')
+    assert not formula.semantic(ks, 'a')
+
+
+def test_only_modal_formulas_are_cached(monkeypatch):
+    ks = KripkeStructure([World('a', {'p': True}), World('b', {})],
+                         {'1': {('a', 'a'), ('a', 'b')}, '2': {('b', 'a')}})
+    formula = And(Box_a('1', Or(Atom('p'), Not(Atom('p')))), Not(Diamond_a('2', Atom('p'))))
+    assert [formula.semantic(ks, world) for world in 'ab'] == [True, False]
+    # One entry per modal operator and world, none for the propositional ones
+    assert len(ks.evaluation_cache) == 4
+    assert ks.evaluation_cache.misses == 4
+
+    # Cached results are found without looking at the relations again
+    monkeypatch.setattr(ks, 'agents', pytest.fail)
+    assert [formula.semantic(ks, world) for world in 'ab'] == [True, False]
+    assert ks.evaluation_cache.hits == 4
+    assert ks.evaluation_cache.misses == 4
+
+
+def random_structure(rng):
+    worlds = [World(name, {'p': rng.random() < 0.5, 'q': rng.random() < 0.5})
+              for name in 'abcd'[:rng.randint(1, 4)]]
+    names = [world.name for world in worlds]
+    relations = {agent: {(start, end) for start in names for end in names if rng.random() < 0.4}
+                 for agent in '12'}
+    return KripkeStructure(worlds, relations)
+
+
+def random_formula(rng, depth):
+    if depth == 0 or rng.random() < 0.2:
+        return Atom(rng.choice('pq'))
+    kind = rng.choice(['not', 'and', 'or', 'implies', 'box', 'diamond', 'box_star'])
+    if kind == 'not':
+        return Not(random_formula(rng, depth - 1))
+    if kind in ('and', 'or', 'implies'):
+        operator = {'and': And, 'or': Or, 'implies': Implies}[kind]
+        return operator(random_formula(rng, depth - 1), random_formula(rng, depth - 1))
+    if kind == 'box_star':
+        return Box_star(random_formula(rng, depth - 1))
+    operator = Box_a if kind == 'box' else Diamond_a
+    return operator(rng.choice('12'), random_formula(rng, depth - 1))
+
+
+def structure_contents(ks):
+    return [world.name for world in ks.worlds], {agent: set(relation) for agent, relation in ks.relations.items()}
+
+
+def test_solve_matches_solve_exhaustive_on_small_models():
+    rng = random.Random(4)
+    announced = 0
+    for _ in range(300):
+        ks = random_structure(rng)
+        formula = random_formula(rng, 3)
+        expected = structure_contents(ks.solve_exhaustive(formula))
+        assert structure_contents(ks.solve(formula)) == expected
+        if is_existential(formula):
+            assert structure_contents(ks.announce(formula)) == expected
+            announced += 1
+    assert announced > 50
+
+
+def test_solve_keeps_the_largest_sub_model_for_boxes():
+    # Announcing removes a, while removing b is enough for the formula to hold everywhere
+    ks = KripkeStructure([World('b', {}), World('a', {'p': True})], {'1': {('a', 'b')}})
+    formula = Or(Box_a('1', Atom('p')), Not(Atom('p')))
+    assert not is_existential(formula)
+    assert structure_contents(ks.solve(formula))[0] == ['a']
+    assert structure_contents(ks.announce(formula))[0] == ['b']
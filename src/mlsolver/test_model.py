@@ -0,0 +1,69 @@
+import contextlib
+import io
+import random
+
+import numpy as np
+
+from mlsolver.formula import Atom, Box_a
+from mlsolver.model import Conjunction, CountingMafia, Mafia, PointedMafia, RoleConstraint, RolePositions
+
+ROLES = {'mafiosi': 1, 'villagers': 2, 'doctors': 1}
+
+
+def quietly(model, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return model(*args)
+
+
+def test_pointed_model_removes_worlds_like_the_full_model():
+    full = quietly(Mafia, ROLES)
+    pointed = quietly(PointedMafia, ROLES, 'MVVD')
+    names = [world.name for world in full.ks.worlds]
+    full.ks.remove_nodes_by_name(['VVMD', 'DVVM'])
+    pointed.ks.remove_nodes_by_name(['VVMD', 'DVVM'])
+    pointed.ks.remove_node_by_name('VMVD')
+    full.ks.remove_node_by_name('VMVD')
+    for name in names:
+        for agent in full.ks.agents():
+            assert pointed.ks.successors(name, agent) == full.ks.successors(name, agent)
+    assert pointed.ks.get_world('VMVD') is None
+
+
+def possible_roles_of_worlds(worlds, letters, players):
+    possible = np.zeros((players, len(letters)), dtype=bool)
+    for world in worlds:
+        for player, letter in enumerate(world):
+            possible[player, letters.index(letter)] = True
+    return possible
+
+
+def test_counting_model_allows_the_roles_of_the_full_model():
+    rng = random.Random(7)
+    roles = {'mafiosi': 2, 'villagers': 2, 'doctors': 1}
+    letters = ['M', 'V', 'D']
+    for _ in range(20):
+        actual_world = ''.join(rng.sample('MMVVD', 5))
+        full = quietly(Mafia, roles)
+        counting = quietly(CountingMafia, roles, actual_world)
+        for _ in range(6):
+            agent = str(rng.randrange(5))
+            player, letter = rng.randrange(5), rng.choice(letters)
+            change = rng.choice(['has', 'has not', 'positions', 'conjunction'])
+            if change == 'positions':
+                full.ks.refine_relation(agent, RolePositions(letter))
+                counting.ks.refine_relation(agent, RolePositions(letter))
+                continue
+            if change == 'conjunction':
+                predicate = Conjunction([RoleConstraint(player, letter, has=False),
+                                         RoleConstraint(rng.randrange(5), 'M', has=False)])
+            else:
+                predicate = RoleConstraint(player, letter, has=change == 'has')
+            full.ks.restrict_relation(agent, predicate)
+            counting.ks.restrict_relation(agent, predicate)
+
+            for other in full.ks.agents():
+                worlds = full.ks.successors(actual_world, other)
+                expected = possible_roles_of_worlds(worlds, letters, 5)
+                assert (counting.ks.possible_roles(other) == expected).all()
+                assert counting.ks.knows(other, Atom(f'{player}:{letter}')) == \
+                    Box_a(other, Atom(f'{player}:{letter}')).semantic(full.ks, actual_world)
@@ -0,0 +1,64 @@
+import pytest
+
+from mlsolver.formula import And, Atom, Box, Box_a, Diamond, Diamond_a, Implies, Not
+from mlsolver.tableau import ProofTree, check_satisfiability
+
+p = Atom('p')
+
+# Formulas and whether they are satisfiable in K and in S5
+FORMULAS = [
+    (And(p, Not(p)), False, False),
+    (And(Diamond(p), Box(Not(p))), False, False),
+    (And(Diamond(p), Diamond(Not(p))), True, True),
+    (Not(Implies(Box(p), p)), True, False),
+    (Not(Implies(Box_a('1', p), Box_a('1', Box_a('1', p)))), True, False),
+    (Not(Implies(Diamond_a('1', p), Box_a('1', Diamond_a('1', p)))), True, False),
+    (And(Diamond_a('1', p), Box_a('2', Not(p))), True, True),
+    (And(Box_a('1', p), Diamond_a('1', Not(p))), False, False),
+]
+
+
+@pytest.mark.parametrize('logic', ['K', 'S5'])
+def test_derive_finds_a_model_iff_the_formula_is_satisfiable(logic):
+    for formula, satisfiable_in_k, satisfiable_in_s5 in FORMULAS:
+        tree = ProofTree(formula, logic)
+        tree.derive()
+        satisfiable = satisfiable_in_k if logic == 'K' else satisfiable_in_s5
+        assert tree.is_closed is not satisfiable, str(formula)
+        if satisfiable:
+            assert formula.semantic(tree.kripke_structure, tree.start_world), str(formula)
+        else:
+            assert tree.kripke_structure is None
+
+
+def test_derive_does_not_recurse_on_deep_formulas():
+    formula = p
+    for _ in range(1200):
+        formula = Diamond(formula)
+    tree = ProofTree(formula)
+    tree.derive()
+    assert not tree.is_closed
+    assert len(tree.kripke_structure.worlds) == 1201
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_batch_results_match_deriving_one_formula_at_a_time(processes):
+    formulas = [formula for formula, _, _ in FORMULAS] * 2
+    results = list(check_satisfiability(formulas, 'S5', processes=processes, chunksize=3))
+    assert [result.formula for result in results] == formulas
+    for result in results:
+        tree = ProofTree(result.formula, 'S5')
+        tree.derive()
+        assert result.is_satisfiable is not tree.is_closed
+        assert not result.timed_out
+        if result.is_satisfiable:
+            assert result.formula.semantic(result.kripke_structure, tree.start_world)
+
+
+def test_batch_reports_formulas_that_time_out():
+    deep = p
+    for _ in range(1200):
+        deep = Diamond(deep)
+    first, second = check_satisfiability([deep, p], timeout=0.01, processes=1)
+    assert first.timed_out and first.is_satisfiable is None
+    assert not second.timed_out and second.is_satisfiable
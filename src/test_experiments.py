@@ -0,0 +1,37 @@
+import contextlib
+import io
+
+import pytest
+
+from experiments import (binomialCdf, clopperPearsonInterval, countWins, parameterGrid, runAdaptive,
+                         wilsonInterval)
+
+
+def test_intervals_match_known_values():
+    assert wilsonInterval(41, 50) == pytest.approx((0.6920, 0.9023), abs=1e-4)
+    assert clopperPearsonInterval(3, 10) == pytest.approx((0.0667, 0.6525), abs=1e-4)
+    assert clopperPearsonInterval(0, 10) == pytest.approx((0.0, 0.3085), abs=1e-4)
+    assert clopperPearsonInterval(10, 10) == pytest.approx((0.6915, 1.0), abs=1e-4)
+    assert binomialCdf(3, 10, 0.3) == pytest.approx(0.6496, abs=1e-4)
+    assert wilsonInterval(0, 0) == clopperPearsonInterval(0, 0) == (0.0, 1.0)
+
+
+def test_adaptive_run_stops_cells_and_continues_from_the_log(tmp_path):
+    cells = parameterGrid(villagers=(3,), mafiosi=(1,), doctors=(0, 1), informants=(0,))
+    options = dict(width=0.32, path=str(tmp_path / 'games.csv'), summary=str(tmp_path / 'summary.csv'),
+                   min_games=20, max_games=40, processes=1, chunksize=10, seed=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = runAdaptive(cells, **options)
+    for cell in stats.values():
+        assert 20 <= cell.games <= 40
+        assert cell.games == 40 or cell.width() < 0.32
+    # Some cells reach the width before max_games, others do not
+    assert len({cell.games for cell in stats.values()}) > 1
+    wins = countWins(options['path'])
+    assert {key: sum(counts.values()) for key, counts in wins.items()} == \
+        {key: cell.games for key, cell in stats.items()}
+
+    # Every cell is done, so running again plays no more games
+    with contextlib.redirect_stdout(io.StringIO()):
+        again = runAdaptive(cells, **options)
+    assert {key: cell.games for key, cell in again.items()} == {key: cell.games for key, cell in stats.items()}
@@ -0,0 +1,35 @@
+from game_log import GameReplay, readGames, writeEvents
+from game_runner import GameRunner, gameRandom
+
+
+def gameState(game):
+    return ([player.player_id for player in game.alivePlayers], game.revealedMafioso,
+            [player.beliefMatrix.tolist() for player in game.allPlayers],
+            [dict(player.accusations) for player in game.allPlayers])
+
+
+def test_replay_of_a_written_log_rebuilds_every_round(tmp_path):
+    logs, rounds = [], []
+    for index, options in enumerate(({}, {'counting': True})):
+        log = []
+        runner = GameRunner(villagers=4, mafiosi=2, doctors=1, rng=gameRandom(2, index), eventLog=log, **options)
+        states = [gameState(runner.game)]
+        while runner.playRound() is None:
+            states.append(gameState(runner.game))
+        logs.append(log)
+        rounds.append((states, runner.winners))
+
+    path = tmp_path / 'games.jsonl'
+    with open(path, 'w') as file:
+        for log in logs:
+            writeEvents(file, log)
+    games = list(readGames(path))
+    assert games == logs
+
+    for events, (states, winners) in zip(games, rounds):
+        replay = GameReplay(events)
+        for round in range(1, len(states) + 1):
+            assert gameState(replay.seekRound(round)) == states[round - 1]
+        # Seeking back replays the log from the start
+        assert gameState(replay.seekRound(1)) == states[0]
+        assert replay.run() == winners
@@ -0,0 +1,38 @@
+from game_runner import GameRunner, gameRandom
+
+
+def test_pointed_game_plays_like_the_full_model():
+    for index in range(5):
+        full = GameRunner(villagers=4, mafiosi=2, rng=gameRandom(1, index)).run()
+        pointed = GameRunner(villagers=4, mafiosi=2, rng=gameRandom(1, index), pointed=True).run()
+        assert pointed.winners in ('Villagers', 'Mafiosi', 'Tie')
+        assert pointed == full
+
+
+def gameState(game):
+    return ([player.player_id for player in game.alivePlayers], game.revealedMafioso,
+            [player.beliefMatrix.tolist() for player in game.allPlayers],
+            [dict(player.accusations) for player in game.allPlayers])
+
+
+def test_playing_a_fork_leaves_the_game_unchanged():
+    for options in ({}, {'pointed': True}, {'counting': True}):
+        reference = GameRunner(villagers=4, mafiosi=2, doctors=1, rng=gameRandom(5, 0), **options)
+        runner = GameRunner(villagers=4, mafiosi=2, doctors=1, rng=gameRandom(5, 0), **options)
+        reference.playRound()
+        runner.playRound()
+        state = gameState(runner.game)
+        relations = None
+        if not options.get('counting'):
+            world = runner.game.currentWorld
+            relations = {agent: set(runner.game.model.ks.successors(world, agent))
+                         for agent in runner.game.model.ks.agents()}
+
+        # The fork plays on with other random numbers
+        forked = runner.fork(rng=gameRandom(6, 0))
+        forked.run()
+        assert gameState(runner.game) == state
+        if relations is not None:
+            assert {agent: set(runner.game.model.ks.successors(world, agent))
+                    for agent in relations} == relations
+        assert runner.run() == reference.run()
@@ -0,0 +1,22 @@
+import math
+from collections import Counter
+
+from experiments import OUTCOMES
+from game_runner import GameRunner, gameRandom
+from win_probability import ExactSolver
+
+
+def test_exact_probabilities_match_played_games():
+    games = 400
+    for settings in ({'villagers': 3, 'mafiosi': 1, 'doctors': 1, 'informants': 0},
+                     {'villagers': 2, 'mafiosi': 1, 'doctors': 1, 'informants': 1}):
+        exact = ExactSolver(**settings).solve()
+        assert set(exact) <= set(OUTCOMES)
+        assert math.isclose(sum(exact.values()), 1)
+        wins = Counter(GameRunner(**settings, rng=gameRandom(11, index), counting=True).run().winners
+                       for index in range(games))
+        for winners in OUTCOMES:
+            probability = exact.get(winners, 0)
+            # Four standard deviations of the mean of the played games
+            tolerance = 4 * math.sqrt(probability * (1 - probability) / games) + 1e-9
+            assert abs(wins[winners] / games - probability) <= tolerance, (settings, winners)
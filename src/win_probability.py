@@ -0,0 +1,406 @@
+import argparse
+from collections import Counter, defaultdict, namedtuple
+from itertools import product
+
+import numpy as np
+
+from experiments import OUTCOMES, SETTINGS, parameterGrid, playGames
+from mafia_players import ROLE_LETTERS, Roles
+from mlsolver.model import CountingStructure, RoleConstraint, RolePositions
+
+# State of a game between two rounds. Players are bits of the masks, by player_id.
+#   alive            players that are alive
+#   revealed         alive players whose role is public, the roles of dead players are public too
+#   innocent         alive players that are publicly known not to be mafiosi
+#   saved            alive players that the doctors know not to be mafiosi
+#   protected        the protected players, that the doctors did not announce yet
+#   revealedMafioso  whether the informant announced a mafioso
+#   voted            alive players that voted against a mafioso in the last day phase
+#   accused          per mafioso the alive players that ever voted against them
+#   targets          per informant the mafioso they know about
+GameState = namedtuple('GameState', ['alive', 'revealed', 'innocent', 'saved', 'protected', 'revealedMafioso',
+                                     'voted', 'accused', 'targets'])
+
+
+def members(mask):
+    # The players of a mask in the order of their player_id
+    players = []
+    player = 0
+    while mask:
+        if mask & 1:
+            players.append(player)
+        mask >>= 1
+        player += 1
+    return players
+
+
+class ExactSolver:
+    """ Computes the probabilities that the villagers win, the mafiosi win or the game ends
+        in a tie, by following every random choice of GameRunner instead of sampling them.
+        Beliefs only depend on which roles are public and what was announced, so they are
+        read from the counting abstraction. The probability of a state is remembered, and
+        so are the beliefs and the outcomes of a day phase, which many states share. """
+
+    def __init__(self, villagers=10, mafiosi=2, doctors=1, informants=1,
+                 mafia_strategy='enemy', informant_strategy='random',
+                 doctors_strategy='deterministic', num_protectedPlayers=1, informant_enabled=True):
+        if mafiosi < 1:
+            raise ValueError("A game needs at least one mafioso")
+        self.mafia_strategy = mafia_strategy
+        self.informant_strategy = informant_strategy
+        self.doctors_strategy = doctors_strategy
+        self.num_protectedPlayers = num_protectedPlayers
+        self.informant_enabled = informant_enabled
+        # The players in the order of MafiaGame
+        self.world = 'M' * mafiosi + 'V' * villagers + 'D' * doctors + 'I' * informants
+        self.counts = {'M': mafiosi, 'V': villagers, 'I': informants, 'D': doctors}
+        self.everyone = (1 << len(self.world)) - 1
+        self.mafiosi = self.mask('M')
+        self.villagers = self.mask('V')
+        self.doctors = self.mask('D')
+        self.informants = members(self.mask('I'))
+        self.informantMask = self.mask('I')
+        self.mafiosiList = members(self.mafiosi)
+        # The votes only matter for the next night phase of these strategies
+        self.trackVotes = mafia_strategy in ('enemy', 'allied')
+        self.values = {}
+        self.targetValues = {}
+        self.beliefCache = {}
+        self.voteCache = {}
+        self.dayCache = {}
+
+    def mask(self, letter):
+        return sum(1 << num for num, role in enumerate(self.world) if role == letter)
+
+    def solve(self):
+        # Each informant knows a mafioso drawn at the start of the game
+        probabilities = Counter()
+        choices = list(product(members(self.mafiosi), repeat=len(self.informants)))
+        for targets in choices:
+            state = self.canonical(GameState(self.everyone, 0, 0, 0, 0, False, 0,
+                                             tuple(0 for _ in self.mafiosiList), targets))
+            for winners, probability in self.value(state).items():
+                probabilities[winners] += probability / len(choices)
+        return {winners: probabilities[winners] for winners in OUTCOMES}
+
+    def value(self, state):
+        # The probabilities of the outcomes from the start of a round in the given canonical state
+        probabilities = self.values.get(state)
+        if probabilities is None:
+            probabilities = self.playRound(state)
+            self.values[state] = probabilities
+        return probabilities
+
+    def canonical(self, state):
+        # Drops what can no longer make a difference, so that more states are the same
+        alive = state.alive
+        revealed = state.revealed & alive
+        innocent = state.innocent & alive & ~revealed
+        doctors = alive & self.doctors
+        unknown = alive & ~revealed & ~innocent
+        return GameState(
+            alive, revealed, innocent,
+            # Only the doctors know about saved players, and protected players are only announced by them
+            state.saved & unknown if doctors else 0,
+            state.protected & alive if doctors else 0,
+            # Without alive informants nothing can be revealed any more
+            self.informant_enabled and (state.revealedMafioso or not alive & self.informantMask),
+            state.voted & alive if self.trackVotes else 0,
+            tuple(accusers & unknown if alive & 1 << mafioso else 0
+                  for mafioso, accusers in zip(self.mafiosiList, state.accused)),
+            tuple(target if target >= 0 and alive & 1 << informant and alive & 1 << target else -1
+                  for informant, target in zip(self.informants, state.targets)))
+
+    def checkWin(self, alive):
+        if not alive & self.mafiosi:
+            return 'Villagers'
+        if not alive & ~self.mafiosi:
+            return 'Mafiosi'
+        return None
+
+    def playRound(self, state):
+        probabilities = Counter()
+        win = self.checkWin(state.alive)
+        if win:
+            probabilities[win] = 1.0
+            return probabilities
+        # The votes only decide the villager the mafiosi choose, so the rest of the round is
+        # shared by the states that differ in their votes
+        base = state._replace(voted=0)
+        for villager, chance in self.nightTargets(state):
+            for winners, probability in self.targetValue(base, villager).items():
+                probabilities[winners] += chance * probability
+        return probabilities
+
+    def targetValue(self, state, villager):
+        # The probabilities of the outcomes once the mafiosi chose the villager to kill
+        key = (state, villager)
+        probabilities = self.targetValues.get(key)
+        if probabilities is not None:
+            return probabilities
+        probabilities = Counter()
+        # The phases are followed one after the other, adding up the chances of equal states
+        days = defaultdict(float)
+        for night, chance in self.nightOutcomes(state, villager):
+            win = self.checkWin(night.alive)
+            if win is None and len(members(night.alive)) <= 2:
+                win = 'Tie'
+            if win:
+                probabilities[win] += chance
+                continue
+            for informed, informedChance in self.informantOutcomes(night):
+                for day, dayChance in self.dayOutcomes(informed):
+                    days[day] += chance * informedChance * dayChance
+        for day, chance in days.items():
+            for winners, probability in self.value(day).items():
+                probabilities[winners] += chance * probability
+        self.targetValues[key] = probabilities
+        return probabilities
+
+    def beliefs(self, state):
+        # The belief matrix of every player, in the order of Roles, as MafiaGame keeps it
+        key = (state.alive, state.revealed, state.innocent, state.saved, state.targets)
+        beliefs = self.beliefCache.get(key)
+        if beliefs is None:
+            ks = CountingStructure(list(self.counts), list(self.counts.values()), self.world)
+            public = ~state.alive & self.everyone | state.revealed
+            for player in members(state.alive):
+                agent = str(player)
+                for other in members(public):
+                    ks.restrict_relation(agent, RoleConstraint(other, self.world[other]))
+                for other in members(state.innocent):
+                    ks.restrict_relation(agent, RoleConstraint(other, 'M', has=False))
+                if self.world[player] == 'M':
+                    ks.refine_relation(agent, RolePositions('M'))
+                elif self.world[player] == 'D':
+                    ks.refine_relation(agent, RolePositions('D'))
+                    for other in members(state.saved):
+                        ks.restrict_relation(agent, RoleConstraint(other, 'M', has=False))
+                elif self.world[player] == 'I':
+                    target = state.targets[self.informants.index(player)]
+                    if target >= 0:
+                        ks.restrict_relation(agent, RoleConstraint(target, 'M'))
+            beliefs = {player: ks.possible_roles(str(player), ROLE_LETTERS) for player in members(state.alive)}
+            self.beliefCache[key] = beliefs
+        return beliefs
+
+    def aliveMask(self, state):
+        alive = np.zeros(len(self.world), dtype=bool)
+        alive[members(state.alive)] = True
+        return alive
+
+    def nightTargets(self, state):
+        # The villager the mafiosi choose and its probability, as in MafiaGame.voteVillager
+        candidates = Counter()
+        villagers = members(state.alive & self.villagers)
+        beliefs = self.beliefs(state)
+        alive = self.aliveMask(state)
+        for roles in (['DOCTOR'], ['VILLAGER', 'DOCTOR', 'INFORMANT']):
+            # Each villager that believes a player to have exactly these roles adds that player once
+            pattern = np.array([role.name in roles for role in Roles])
+            for villager in villagers:
+                candidates.update(np.flatnonzero((beliefs[villager] == pattern).all(axis=1) & alive).tolist())
+            if candidates:
+                break
+        if not candidates:
+            innocents = state.alive & ~self.mafiosi
+            if state.alive == self.everyone or self.mafia_strategy not in ('enemy', 'allied'):
+                # In the first round the mafiosi always choose randomly
+                chosen = 0
+            elif self.mafia_strategy == 'enemy':
+                chosen = state.voted & state.alive
+            else:
+                chosen = innocents & ~state.voted
+            candidates = Counter(members(chosen or innocents))
+        total = sum(candidates.values())
+        return [(villager, count / total) for villager, count in candidates.items()]
+
+    def protectedIsKnown(self, state, protected):
+        # Whether the first alive villager, other than the protected player, knows that the
+        # protected player is not a mafioso
+        for villager in members(state.alive & self.villagers):
+            if villager != protected:
+                return not self.beliefs(state)[villager][protected, Roles.MAFIOSO.value]
+        return False
+
+    def kill(self, state, player):
+        # Everything about dead players is dropped by canonical
+        return self.canonical(state._replace(alive=state.alive & ~(1 << player)))
+
+    def nightOutcomes(self, state, villager):
+        # The states after the mafiosi tried to kill the villager, and the doctors protected
+        # a random player, with their probabilities
+        if not state.alive & self.doctors:
+            return self.doctorsOutcomes(self.kill(state, villager))
+        # Only whether the doctors protect the villager makes a difference
+        chance = 1 / len(members(state.alive))
+        saved = state
+        if not self.protectedIsKnown(state, villager):
+            saved = state._replace(protected=state.protected | 1 << villager, saved=state.saved | 1 << villager)
+        return [(night, nightChance * chance) for night, nightChance in self.doctorsOutcomes(saved)] + \
+            [(night, nightChance * (1 - chance)) for night, nightChance in self.doctorsOutcomes(self.kill(state, villager))]
+
+    def doctorsOutcomes(self, state):
+        # The states after the doctors might have announced the protected players
+        if not state.alive & self.doctors:
+            return [(state, 1)]
+        protectedCount = len(members(state.protected))
+        if self.doctors_strategy == 'deterministic' and protectedCount == self.num_protectedPlayers:
+            return self.announcements(state)
+        elif self.doctors_strategy == 'random' and protectedCount > 0:
+            return [(state, 0.5)] + [(announced, chance / 2) for announced, chance in self.announcements(state)]
+        return [(state, 1)]
+
+    def announcements(self, state):
+        # One of the protected doctors, or else of all alive doctors, announces the protected players
+        doctors = members(state.alive & self.doctors & state.protected) or members(state.alive & self.doctors)
+        return [(state._replace(innocent=state.innocent | state.protected, revealed=state.revealed | 1 << doctor,
+                                protected=0), 1 / len(doctors))
+                for doctor in doctors]
+
+    def informantOutcomes(self, state):
+        if not self.informant_enabled or state.revealedMafioso:
+            return [(state, 1)]
+        mafioso, informant = self.findMafioso(state)
+        if mafioso is None or not state.alive & 1 << mafioso:
+            return [(state, 1)]
+        revealed = state._replace(revealed=state.revealed | 1 << mafioso | 1 << informant, revealedMafioso=True)
+        if len(members(state.alive & self.mafiosi)) == 1 or self.informant_strategy == 'deterministic':
+            return [(revealed, 1)]
+        elif self.informant_strategy == 'random':
+            return [(revealed, 0.5), (state, 0.5)]
+        return [(state, 1)]
+
+    def findMafioso(self, state):
+        # The first mafioso, dead or alive, that the first informant knows of, as in MafiaGame
+        onlyMafioso = np.arange(len(Roles)) == Roles.MAFIOSO.value
+        beliefs = self.beliefs(state)
+        for informant in members(state.alive):
+            if self.world[informant] != 'I':
+                continue
+            for mafioso in members(self.mafiosi):
+                if (beliefs[informant][mafioso] == onlyMafioso).all():
+                    return mafioso, informant
+        return None, None
+
+    def votes(self, state):
+        # The possible targets of the vote of each alive player, who votes for one of them at random
+        key = (state.alive, state.revealed, state.innocent, state.saved, state.targets)
+        voters = self.voteCache.get(key)
+        if voters is not None:
+            return voters
+        beliefs = self.beliefs(state)
+        alive = self.aliveMask(state)
+        voters = []
+        for voter in members(state.alive):
+            if self.world[voter] == 'M':
+                candidates = np.flatnonzero(alive & ~beliefs[voter][:, Roles.MAFIOSO.value])
+            else:
+                possible = alive & beliefs[voter][:, Roles.MAFIOSO.value]
+                suspected = np.flatnonzero(possible & (beliefs[voter].sum(axis=1) == 1))
+                candidates = suspected[:1] if suspected.size else np.flatnonzero(possible)
+            voters.append((voter, tuple(candidates.tolist())))
+        voters = self.voteCache[key] = tuple(voters)
+        return voters
+
+    def dayOutcomes(self, state):
+        # The states after the day phase with their probabilities
+        results = []
+        # Accusations only make a difference for players that are not known to be innocent
+        accusers = state.alive & ~self.mafiosi & ~state.revealed & ~state.innocent
+        tracked = state.alive & ~self.mafiosi if self.trackVotes else 0
+        for eliminated, voted, accused, chance in self.tally(self.votes(state), accusers, tracked):
+            accused = tuple(old | new for old, new in zip(state.accused, accused))
+            innocent = state.innocent
+            if self.world[eliminated] == 'M':
+                # Who voted against the eliminated mafioso is known not to be a mafioso
+                innocent |= accused[self.mafiosiList.index(eliminated)]
+            day = state._replace(alive=state.alive & ~(1 << eliminated), innocent=innocent, voted=voted,
+                                 accused=accused)
+            results.append((self.canonical(day), chance))
+        return results
+
+    def tally(self, voters, accusers, tracked):
+        # Returns the eliminated player, the tracked voters against a mafioso, the accusers
+        # per mafioso among the given ones and the probability of each outcome of the vote.
+        # The votes are counted in the order of the voters and ties go to the player that
+        # got a vote first.
+        key = (voters, accusers, tracked)
+        outcomes = self.dayCache.get(key)
+        if outcomes is not None:
+            return outcomes
+        size = len(self.world)
+        mafiosi = self.mafiosiList
+        # The voted mask and the accused masks are kept together in the bits of one number,
+        # the voted mask first and then the accusers of each mafioso
+        choices = []
+        for voter, candidates in voters:
+            marks = []
+            for candidate in candidates:
+                mark = 0
+                if self.world[candidate] == 'M':
+                    mark = (tracked & 1 << voter) | (accusers & 1 << voter) << size * (mafiosi.index(candidate) + 1)
+                marks.append((candidate, mark))
+            choices.append((marks, 1 / len(candidates)))
+        # Candidates in the order of their first vote, their votes and the marks
+        counts = {((), (), 0): 1.0}
+        for num, (marks, candidateChance) in enumerate(choices):
+            remaining = len(choices) - num - 1
+            next_counts = defaultdict(float)
+            for (order, votes, marked), chance in counts.items():
+                chance *= candidateChance
+                for candidate, mark in marks:
+                    if candidate in order:
+                        index = order.index(candidate)
+                        new_order, new_votes = order, votes[:index] + (votes[index] + 1,) + votes[index + 1:]
+                    else:
+                        new_order, new_votes = order + (candidate,), votes + (1,)
+                    # Candidates that cannot catch up with the leader any more are dropped
+                    leader = max(new_votes)
+                    if min(new_votes) + remaining < leader:
+                        kept = [index for index, count in enumerate(new_votes) if count + remaining >= leader]
+                        new_order = tuple(new_order[index] for index in kept)
+                        new_votes = tuple(new_votes[index] for index in kept)
+                    next_counts[new_order, new_votes, marked | mark] += chance
+            counts = next_counts
+        results = defaultdict(float)
+        for (order, votes, marked), chance in counts.items():
+            results[order[votes.index(max(votes))], marked] += chance
+        full = (1 << size) - 1
+        outcomes = [(eliminated, marked & full,
+                     tuple(marked >> size * (index + 1) & full for index in range(len(mafiosi))), chance)
+                    for (eliminated, marked), chance in results.items()]
+        self.dayCache[key] = outcomes
+        return outcomes
+
+
+def winProbabilities(**settings):
+    # The exact probabilities of the outcomes of a game with the settings of GameRunner
+    return ExactSolver(**settings).solve()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the exact probabilities of the outcomes of Mafia "
+                                                 "for every cell of a parameter grid.")
+    parser.add_argument('--villagers', type=int, nargs='+', default=[4])
+    parser.add_argument('--mafiosi', type=int, nargs='+', default=[2])
+    parser.add_argument('--doctors', type=int, nargs='+', default=[1])
+    parser.add_argument('--informants', type=int, nargs='+', default=[1])
+    parser.add_argument('--simulate', type=int, default=0,
+                        help="also play this many games per cell to compare with")
+    args = parser.parse_args()
+
+    cells = parameterGrid(args.villagers, args.mafiosi, args.doctors, args.informants)
+    for settings in cells:
+        probabilities = winProbabilities(**settings)
+        line = ' '.join(str(settings[name]) for name in SETTINGS) + ': ' + \
+            ', '.join(f"{winners} {probability:.4f}" for winners, probability in probabilities.items())
+        if args.simulate:
+            wins = Counter(winners for winners, _ in playGames(settings, 0, args.simulate))
+            line += ' (simulated ' + ', '.join(f"{winners} {wins[winners] / args.simulate:.4f}"
+                                               for winners in OUTCOMES) + ')'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()